@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        import api.signals  # noqa: F401
+        from api.db import check_connections, configure_sqlite
+
+        request_started.connect(check_connections)
+        connection_created.connect(configure_sqlite)
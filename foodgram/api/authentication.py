@@ -0,0 +1,124 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api import cache
+
+
+def auth_state(user_id):
+    """Версия входа пользователя, общая для всех процессов."""
+
+    return f'auth:{user_id}'
+
+
+class TokenCache:
+    """Кэш токен → пользователь в памяти процесса.
+
+    Размер ограничен TOKEN_CACHE_SIZE, старые записи вытесняются (LRU),
+    запись живёт не дольше TOKEN_CACHE_TTL секунд. Запись сверяется с
+    версией входа пользователя в общем кэше, поэтому выход или
+    блокировка в одном процессе сбрасывают записи во всех.
+
+    Если кэш процесса (LocMemCache), версию из другого процесса не
+    увидеть: тогда запись раз в TOKEN_CACHE_REVALIDATE секунд
+    подтверждается проверкой, что токен есть в базе и пользователь
+    активен. Между проверками попадание обходится без запросов, а токен,
+    отозванный в другом процессе, перестаёт работать не позже чем через
+    TOKEN_CACHE_REVALIDATE секунд.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self.entries[key]
+                entry = None
+        if entry is not None:
+            _, version, user, token, checked = entry
+            if (cache.get_versions((auth_state(user.pk),))[0] == version
+                    and self.revalidate(key, checked, now)):
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key, last=True)
+                    self.hits += 1
+                return user, token
+            self.invalidate(key)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def revalidate(self, key, checked, now):
+        """Проверка записи по базе, если версии входа не общие."""
+
+        if (cache.is_shared()
+                or now - checked < settings.TOKEN_CACHE_REVALIDATE):
+            return True
+        if not Token.objects.filter(pk=key, user__is_active=True).exists():
+            return False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = (*entry[:4], now)
+        return True
+
+    def set(self, key, user, token):
+        version = cache.get_versions((auth_state(user.pk),))[0]
+        now = time.monotonic()
+        expires = now + settings.TOKEN_CACHE_TTL
+        with self.lock:
+            self.entries[key] = (expires, version, user, token, now)
+            self.entries.move_to_end(key, last=True)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        """Сброс записей пользователя во всех процессах."""
+
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if entry[2].pk == user_id:
+                    del self.entries[key]
+        cache.bump_versions((auth_state(user_id),))
+
+    def get_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену без запросов к базе при попадании в кэш."""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token = cached
+            # Копия, чтобы изменения в запросе не попали в общий кэш.
+            return copy.copy(user), token
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
@@ -0,0 +1,210 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.models import Recipe, Tag
+
+
+ALL_RECIPES = 'all'
+TAGS_VERSION = 'tags'
+HITS_KEY = 'recipes:stats:hits'
+MISSES_KEY = 'recipes:stats:misses'
+
+
+def get_cache():
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def is_shared():
+    """Видят ли записи кэша все процессы, а не только текущий."""
+
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def snapshot_expired(built_at):
+    """Пора ли перестроить снимок в памяти процесса по времени.
+
+    Кэш процесса не видит версий, сменённых в других процессах, поэтому
+    без общего кэша снимок живёт не дольше CATALOGUE_REFRESH_INTERVAL
+    секунд.
+    """
+
+    return (
+        not is_shared()
+        and time.monotonic() - built_at >= settings.CATALOGUE_REFRESH_INTERVAL
+    )
+
+
+def version_key(name):
+    return f'recipes:version:{name}'
+
+
+def get_versions(names):
+    """Текущие версии зависимостей.
+
+    Отсутствующая версия создаётся заново случайным токеном, поэтому
+    вытеснение ключа версии из кэша не может воскресить старые ответы.
+    """
+
+    cache = get_cache()
+    keys = sorted(version_key(name) for name in names)
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [str(versions[key]) for key in keys]
+
+
+def bump_versions(names):
+    """Сброс всех ответов, зависящих от names, после фиксации транзакции."""
+
+    def bump():
+        get_cache().set_many(
+            {version_key(name): uuid.uuid4().hex for name in names},
+            None
+        )
+    if names:
+        transaction.on_commit(bump)
+
+
+def invalidate(recipe_ids=(), author_ids=(), tag_slugs=()):
+    """Сброс страниц, на которых могут быть показаны рецепты."""
+
+    recipe_ids = set(recipe_ids)
+    author_ids = set(author_ids)
+    tag_slugs = set(tag_slugs)
+    if recipe_ids:
+        author_ids.update(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('author_id', flat=True))
+        tag_slugs.update(Tag.objects.filter(
+            recipes__in=recipe_ids
+        ).values_list('slug', flat=True))
+    names = {ALL_RECIPES}
+    names.update(f'recipe:{pk}' for pk in recipe_ids)
+    names.update(f'author:{pk}' for pk in author_ids)
+    names.update(f'tag:{slug}' for slug in tag_slugs)
+    bump_versions(names)
+
+
+def user_state(user_id):
+    """Версия избранного, списка покупок и подписок пользователя."""
+
+    return f'user:{user_id}'
+
+
+def list_dependencies(query_params):
+    """Версии, от которых зависит страница списка рецептов."""
+
+    dependencies = [f'tag:{slug}' for slug in query_params.getlist('tags')]
+    author = query_params.get('author')
+    if author:
+        try:
+            dependencies.append(f'author:{int(author)}')
+        except ValueError:
+            pass
+    return dependencies or [ALL_RECIPES]
+
+
+def detail_dependencies(pk):
+    """Версии, от которых зависит страница рецепта."""
+
+    try:
+        return [f'recipe:{int(pk)}']
+    except ValueError:
+        return [ALL_RECIPES]
+
+
+def make_key(request, dependencies):
+    params = sorted(
+        (name, sorted(request.query_params.getlist(name)))
+        for name in request.query_params
+    )
+    raw = '|'.join((
+        request.scheme,
+        request.get_host(),
+        request.path,
+        repr(params),
+        *get_versions(dependencies),
+    ))
+    return 'recipes:response:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def incr(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def cached_response(request, dependencies, get_response):
+    """Ответ для анонимного пользователя из кэша или из get_response."""
+
+    if not request.user.is_anonymous:
+        return get_response()
+    cache = get_cache()
+    key = make_key(request, dependencies)
+    data = cache.get(key)
+    if data is not None:
+        incr(HITS_KEY)
+        response = Response(data)
+        response['X-Cache'] = 'HIT'
+        return response
+    incr(MISSES_KEY)
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def fragment_key(request, recipe):
+    host = f'{request.scheme}://{request.get_host()}' if request else ''
+    return f'recipes:fragment:{host}:{recipe.pk}:{recipe.revision}'
+
+
+def get_fragments(request, recipes, render):
+    """Представления рецептов из кэша одним запросом get_many.
+
+    Недостающие фрагменты строятся вызовом render для всех промахов
+    сразу и сохраняются одним set_many.
+    """
+
+    cache = get_cache()
+    keys = {recipe.pk: fragment_key(request, recipe) for recipe in recipes}
+    cached = cache.get_many(keys.values())
+    fragments = {
+        pk: cached[key] for pk, key in keys.items() if key in cached
+    }
+    missing = [recipe for recipe in recipes if recipe.pk not in fragments]
+    if missing:
+        rendered = render(missing)
+        cache.set_many(
+            {keys[pk]: fragment for pk, fragment in rendered.items()},
+            settings.RECIPE_FRAGMENT_TIMEOUT
+        )
+        fragments.update(rendered)
+    return fragments
+
+
+def get_stats():
+    stats = get_cache().get_many((HITS_KEY, MISSES_KEY))
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
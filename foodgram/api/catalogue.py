@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+
+from api import cache
+from api.ingredient_index import INGREDIENTS_VERSION
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+
+Snapshot = namedtuple('Snapshot', ('version', 'data', 'body', 'compressed'))
+
+
+class Catalogue:
+    """Неизменяемый снимок справочника в памяти процесса.
+
+    Снимок строится при первом обращении и перестраивается, когда в кэше
+    меняется версия справочника, а без общего кэша — ещё и по времени.
+    Версия снимка — хэш его содержимого, поэтому перестроенный без
+    изменений снимок сохраняет версию. Тело ответа хранится готовым JSON
+    и заранее сжатым gzip.
+    """
+
+    def __init__(self, cache_version, queryset, serializer_class):
+        self.cache_version = cache_version
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.lock = threading.Lock()
+        self.token = None
+        self.built_at = None
+        self.snapshot = None
+
+    def get_snapshot(self):
+        token = cache.get_versions((self.cache_version,))[0]
+        if self.is_stale(token):
+            with self.lock:
+                if self.is_stale(token):
+                    self.rebuild(token)
+        return self.snapshot
+
+    def is_stale(self, token):
+        return token != self.token or cache.snapshot_expired(self.built_at)
+
+    def rebuild(self, token):
+        data = self.serializer_class(
+            self.queryset.order_by('pk'), many=True
+        ).data
+        body = json.dumps(
+            data, ensure_ascii=False, separators=(',', ':')
+        ).encode()
+        self.snapshot = Snapshot(
+            version=hashlib.sha256(body).hexdigest()[:16],
+            data=data,
+            body=body,
+            compressed=gzip.compress(body, compresslevel=9),
+        )
+        self.token = token
+        self.built_at = time.monotonic()
+
+
+catalogues = {
+    'tags': Catalogue(cache.TAGS_VERSION, Tag.objects.all(), TagSerializer),
+    'ingredients': Catalogue(
+        INGREDIENTS_VERSION, Ingredient.objects.all(), IngredientSerializer
+    ),
+}
@@ -0,0 +1,79 @@
+import hashlib
+import json
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from api import cache
+
+
+def make_etag(request, validators, per_user=True):
+    """ETag из адреса запроса, валидаторов и состояния пользователя.
+
+    Версия состояния пользователя хранится в кэше. Если кэш в памяти
+    процесса, изменение избранного или подписок в другом процессе её не
+    меняет: тогда ETag для пользователя не строится и возвращается None.
+    """
+
+    parts = [request.get_full_path(), *map(str, validators)]
+    if per_user and not request.user.is_anonymous:
+        if not cache.is_shared():
+            return None
+        parts.append(str(request.user.pk))
+        parts.extend(cache.get_versions((cache.user_state(request.user.pk),)))
+    return quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+
+def conditional_response(request, validators, get_response,
+                         last_modified=None, per_user=True):
+    """Ответ 304, если у клиента актуальная версия, иначе get_response().
+
+    Проверка выполняется до сериализации. Last-Modified отдаётся только
+    анонимным пользователям: флаги пользователя меняются без изменения
+    рецептов. per_user=False — ответ одинаков для всех пользователей.
+    """
+
+    etag = make_etag(request, validators, per_user)
+    if etag is None:
+        return get_response()
+    if last_modified is not None and request.user.is_anonymous:
+        last_modified = timegm(last_modified.utctimetuple())
+    else:
+        last_modified = None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = get_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def content_conditional_response(request, response):
+    """Ответ 304 по ETag из содержимого уже построенного ответа.
+
+    Для выборок без дешёвого валидатора: страница строится, как обычно,
+    не отправляется только тело. Флаги пользователя входят в содержимое,
+    поэтому ETag меняется вместе с ними.
+    """
+
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    body = json.dumps(response.data, cls=JSONEncoder, sort_keys=True)
+    etag = quote_etag(hashlib.md5(
+        f'{request.get_full_path()}|{body}'.encode()
+    ).hexdigest())
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        response = not_modified
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Authorization',))
+    return response
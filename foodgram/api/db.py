@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connections, transaction
+
+from api import cache
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+state = threading.local()
+
+
+def sticky_key(request):
+    """Ключ клиента для чтения своих записей, если клиент известен."""
+
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    digest = hashlib.md5(credentials.encode()).hexdigest()
+    return f'db:sticky:{digest}'
+
+
+class ReplicaRouter:
+    """Чтение с реплик в безопасных запросах, запись — в основную базу.
+
+    Реплики перечислены в DATABASE_REPLICAS. Вне запросов (команды,
+    фоновые задачи) и в запросах, которые меняют данные, все запросы
+    идут в основную базу. Токены всегда читаются из основной базы:
+    только что выданный токен мог ещё не дойти до реплики.
+    """
+
+    primary_apps = ('authtoken',)
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(state, 'replica', None)
+        if replica and model._meta.app_label not in self.primary_apps:
+            return replica
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaMiddleware:
+    """Выбор базы для чтения на время запроса.
+
+    После запроса, меняющего данные, клиент на
+    DATABASE_REPLICA_STICKY_SECONDS секунд читает из основной базы и
+    видит свои изменения, даже если реплика отстаёт. Отметка хранится
+    в кэше, поэтому с репликами он должен быть общим для всех процессов:
+    иначе следующий запрос в другой процесс прочитает устаревшую реплику.
+
+    Реплика выбирается один раз на запрос: реплики отстают по-разному,
+    и чтения из разных реплик могли бы противоречить друг другу.
+    """
+
+    def __init__(self, get_response):
+        if settings.DATABASE_REPLICAS and not cache.is_shared():
+            raise ImproperlyConfigured(
+                'Для реплик нужен общий для процессов кэш: '
+                f'{settings.RECIPE_CACHE_ALIAS} сейчас в памяти процесса.'
+            )
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = sticky_key(request)
+        if request.method in SAFE_METHODS and (
+            key is None or not cache.get_cache().get(key)
+        ):
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        try:
+            response = self.get_response(request)
+        finally:
+            state.replica = None
+        if request.method not in SAFE_METHODS and key is not None:
+            cache.get_cache().set(
+                key, True, settings.DATABASE_REPLICA_STICKY_SECONDS
+            )
+        return response
+
+
+def check_connections(**kwargs):
+    """Проверка постоянных соединений перед запросом.
+
+    Соединение, простоявшее дольше DATABASE_HEALTH_CHECK_INTERVAL
+    секунд, проверяется и закрывается, если база его уже не принимает;
+    новое откроется при первом обращении.
+    """
+
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        checked_at = getattr(connection, 'health_checked_at', 0)
+        if now - checked_at < settings.DATABASE_HEALTH_CHECK_INTERVAL:
+            continue
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            connection.close()
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Параметры SQLITE_PRAGMAS для каждого нового соединения SQLite.
+
+    PRAGMA выполняются прямо на соединении sqlite3, в обход обёрток
+    execute: настройка соединения не считается запросами того запроса
+    к API, который его открыл.
+    """
+
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def retry_on_locked(func):
+    """Повтор записи, если SQLite ответила «database is locked».
+
+    Каждая попытка выполняется в транзакции, чтобы при повторе не осталось
+    записей, сделанных до ошибки: например, рецепта в списке покупок без
+    пересчитанного списка. Запись повторяется до SQLITE_LOCKED_RETRIES раз
+    с растущей паузой, только вне внешней транзакции: внутри неё повторять
+    нужно всю транзакцию.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = settings.SQLITE_LOCKED_RETRIES
+        nested = connections['default'].in_atomic_block
+        for attempt in range(retries + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as error:
+                if ('database is locked' not in str(error)
+                        or nested or attempt == retries):
+                    raise
+            time.sleep(
+                settings.SQLITE_LOCKED_BACKOFF * 2 ** attempt
+                * random.uniform(0.5, 1.5)
+            )
+    return wrapper
@@ -2,17 +2,8 @@ import django_filters
 from django_filters import rest_framework
 from django_filters.rest_framework import FilterSet
 
-from recipes.models import Ingredient, Recipe, Tag
-
-
-class IngredientFilter(FilterSet):
-    """Поиск по названию ингредиента."""
-
-    name = rest_framework.CharFilter(lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 
 
 class RecipeFilter(FilterSet):
@@ -23,6 +14,8 @@ class RecipeFilter(FilterSet):
         field_name='tags__slug',
         to_field_name='slug'
     )
+    name = rest_framework.CharFilter(method='name_filter')
+    search = rest_framework.CharFilter(method='search_filter')
     is_favorited = django_filters.filters.NumberFilter(
         method='is_recipe_in_favorites_filter'
     )
@@ -30,21 +23,29 @@ class RecipeFilter(FilterSet):
         method='is_recipe_in_shoppingcart_filter'
     )
 
+    @staticmethod
+    def name_filter(queryset, name, value):
+        return queryset.search_prefix(value)
+
+    @staticmethod
+    def search_filter(queryset, name, value):
+        return search_recipes(queryset, value)
+
     def is_recipe_in_favorites_filter(self, queryset, name, value):
         if value == 1:
-            user = self.request.user
-            return queryset.filter(favorites__user_id=user.id)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def is_recipe_in_shoppingcart_filter(self, queryset, name, value):
         if value == 1:
-            user = self.request.user
-            return queryset.filter(shopping_recipe__user_id=user.id)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
     class Meta:
         model = Recipe
         fields = (
+            'name',
+            'search',
             'tags',
             'author',
             'is_favorited',
@@ -0,0 +1,79 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from api import cache
+from recipes.models import Ingredient, normalize_search
+
+
+INGREDIENTS_VERSION = 'ingredients'
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Справочник загружается при первом обращении и перестраивается, когда
+    в кэше меняется версия ингредиентов, а без общего кэша — ещё и раз в
+    CATALOGUE_REFRESH_INTERVAL секунд. Поиск по префиксу идёт бинарным
+    поиском по отсортированным названиям, база данных не используется.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.built_at = None
+        self.snapshot = ((), ())
+
+    def get_snapshot(self):
+        version = cache.get_versions((INGREDIENTS_VERSION,))[0]
+        if self.is_stale(version):
+            with self.lock:
+                if self.is_stale(version):
+                    self.rebuild(version)
+        return self.snapshot
+
+    def is_stale(self, version):
+        return (version != self.version
+                or cache.snapshot_expired(self.built_at))
+
+    def rebuild(self, version):
+        rows = sorted(
+            (normalize_search(name), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = tuple(row[0] for row in rows)
+        entries = tuple(
+            OrderedDict((
+                ('id', pk),
+                ('name', name),
+                ('measurement_unit', measurement_unit),
+            ))
+            for _, pk, name, measurement_unit in rows
+        )
+        self.snapshot = (keys, entries)
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def search(self, query, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+
+        keys, entries = self.get_snapshot()
+        query = normalize_search(query)
+        result = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(result) < limit
+                and keys[position].startswith(query)):
+            result.append(entries[position])
+            position += 1
+        for key, entry in zip(keys, entries):
+            if len(result) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                result.append(entry)
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,523 @@
+import base64
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import seeding
+from api.catalogue import catalogues
+from recipes import images
+from recipes.models import (
+    FavoriteRecipe, Ingredient, Recipe, ShoppingCart, Tag
+)
+from users.models import Subscribe, User
+
+
+BENCH_PASSWORD = 'bench-Password-2021'
+# Избранное, покупки и подписки читающего пользователя замера.
+READER_LINKS = 20
+
+clients = threading.local()
+
+
+def get_client():
+    """Клиент на поток: тестовый клиент не рассчитан на общий доступ.
+
+    Исключения в обработчиках возвращаются ответом 500 и считаются
+    ошибками, а не прерывают замер.
+    """
+
+    client = getattr(clients, 'client', None)
+    if client is None:
+        client = clients.client = Client(
+            raise_request_exception=False, HTTP_HOST='localhost'
+        )
+    return client
+
+
+def percentile(values, rank):
+    """Перцентиль методом ближайшего ранга по отсортированному списку."""
+
+    if not values:
+        return None
+    index = max(0, -(-len(values) * rank // 100) - 1)
+    return values[int(index)]
+
+
+class Endpoint:
+    """Запрос к одному адресу API.
+
+    path, token и data — значения или функции от номера запроса, чтобы
+    пишущие запросы не конфликтовали между собой. collect получает номер
+    и ответ: так следующий адрес узнаёт созданные объекты.
+    """
+
+    def __init__(self, name, method, path, token=None, data=None,
+                 expected=(200,), collect=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.token = token
+        self.data = data
+        self.expected = expected
+        self.collect = collect
+
+    def request(self, number):
+        path = self.path(number) if callable(self.path) else self.path
+        data = self.data(number) if callable(self.data) else self.data
+        token = self.token(number) if callable(self.token) else self.token
+        extra = {}
+        if token:
+            extra['HTTP_AUTHORIZATION'] = f'Token {token}'
+        client = get_client()
+        method = getattr(client, self.method)
+        if data is None:
+            return method(path, **extra)
+        return method(path, data, content_type='application/json', **extra)
+
+
+def close_worker_connections(executor, workers):
+    """Закрывает соединения с базой во всех потоках пула.
+
+    Задачи ждут друг друга на барьере, поэтому каждая выполняется в
+    своём потоке.
+    """
+
+    barrier = threading.Barrier(workers)
+
+    def close(number):
+        barrier.wait()
+        connections.close_all()
+    list(executor.map(close, range(workers)))
+
+
+def measure(endpoint, number):
+    started = time.perf_counter()
+    response = endpoint.request(number)
+    if response.streaming:
+        # Потоковый ответ выполняет запросы к базе по мере чтения тела.
+        b''.join(response.streaming_content)
+    elapsed = time.perf_counter() - started
+    # Закрытие потока ответа вызывает request_finished и освобождает
+    # соединения с базой, открытые в этом потоке.
+    response.close()
+    if endpoint.collect and response.status_code in endpoint.expected:
+        endpoint.collect(number, response)
+    metrics = getattr(response.wsgi_request, 'metrics', None)
+    queries = metrics.queries if metrics else None
+    return elapsed, response.status_code, queries
+
+
+class Command(BaseCommand):
+    """Команда для нагрузочного замера всех адресов API.
+
+    Результаты сохраняются в JSON, чтобы сравнивать прогоны на разных
+    коммитах.
+    """
+
+    help = 'Нагрузочный замер адресов API на синтетических данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--favorites', type=int, default=20000)
+        parser.add_argument('--carts', type=int, default=5000)
+        parser.add_argument('--subscriptions', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-seed',
+            action='store_true',
+            help=(
+                'Замерять на текущей базе вместо временной с синтетическими '
+                'данными'
+            )
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Запросов на каждый адрес'
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--output', default='benchmark.json')
+
+    def handle(self, *args, **kwargs):
+        # Метка прогона: пользователи и рецепты замера не пересекаются с
+        # чужими, и после замера удаляются только они.
+        run = uuid.uuid4().hex[:8]
+        workdir = tempfile.TemporaryDirectory()
+        isolation = {'MEDIA_ROOT': os.path.join(workdir.name, 'media')}
+        if not kwargs['no_seed']:
+            # Записи временной базы не должны попасть в кэш сайта.
+            isolation['CACHES'] = {
+                alias: {**config, 'KEY_PREFIX': f'benchmark-{run}'}
+                for alias, config in settings.CACHES.items()
+            }
+        old_names = None
+        try:
+            with override_settings(**isolation):
+                if not kwargs['no_seed']:
+                    old_names = self.create_database(workdir.name)
+                    self.seed(kwargs)
+                try:
+                    report = self.benchmark(run, kwargs)
+                finally:
+                    images.drain()
+                    User.objects.filter(
+                        username__startswith=f'bench-{run}-'
+                    ).delete()
+        finally:
+            if old_names is not None:
+                self.destroy_database(old_names)
+            workdir.cleanup()
+        with open(kwargs['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print('Результаты сохранены в', kwargs['output'])
+
+    @staticmethod
+    def create_database(directory):
+        """Временная база вместо основной на время замера.
+
+        Возвращает прежние имена баз. Основная база и её данные не
+        меняются; реплики читают из временной базы, как в тестах.
+        SQLite хранится в файле: общая база в памяти не выдерживает
+        параллельной записи из потоков замера.
+        """
+
+        connection = connections['default']
+        old_names = {
+            alias: connections[alias].settings_dict['NAME']
+            for alias in ['default', *settings.DATABASE_REPLICAS]
+        }
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'benchmark.sqlite3'
+            )
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        for alias in settings.DATABASE_REPLICAS:
+            connections[alias].creation.set_as_test_mirror(
+                connection.settings_dict
+            )
+        return old_names
+
+    @staticmethod
+    def destroy_database(old_names):
+        connections.close_all()
+        connections['default'].creation.destroy_test_db(
+            old_names['default'], verbosity=0
+        )
+        for alias in settings.DATABASE_REPLICAS:
+            connections[alias].settings_dict['NAME'] = old_names[alias]
+
+    @staticmethod
+    def seed(kwargs):
+        started = time.perf_counter()
+        seeding.seed(
+            users=kwargs['users'],
+            recipes=kwargs['recipes'],
+            favorites=kwargs['favorites'],
+            carts=kwargs['carts'],
+            subscriptions=kwargs['subscriptions'],
+            seed=kwargs['seed'],
+        )
+        print(f'Данные созданы за {time.perf_counter() - started:.1f} с')
+
+    def benchmark(self, run, kwargs):
+        rng = random.Random(kwargs['seed'])
+        endpoints = self.get_endpoints(rng, kwargs['requests'], run)
+        results = {}
+        # Потоки и их соединения с базой общие для всех адресов: иначе
+        # первые запросы каждого адреса платили бы за новое соединение.
+        with ThreadPoolExecutor(kwargs['workers']) as executor:
+            try:
+                for endpoint in endpoints:
+                    results[endpoint.name] = self.run(
+                        executor, endpoint, kwargs['requests']
+                    )
+                    self.report(endpoint.name, results[endpoint.name])
+            finally:
+                # Открытые соединения потоков помешали бы удалить
+                # временную базу.
+                close_worker_connections(executor, kwargs['workers'])
+        return {
+            'commit': self.get_commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+                'tags': Tag.objects.count(),
+            },
+            'requests': kwargs['requests'],
+            'workers': kwargs['workers'],
+            'endpoints': results,
+        }
+
+    @staticmethod
+    def create_bench_user(run, name):
+        user = User.objects.create_user(
+            email=f'bench-{run}-{name}@example.com',
+            username=f'bench-{run}-{name}',
+            first_name='Замер',
+            last_name='Замер',
+            password=BENCH_PASSWORD,
+        )
+        return user, Token.objects.create(user=user).key
+
+    def get_endpoints(self, rng, requests, run):
+        user_ids = list(User.objects.values_list('pk', flat=True)[:1000])
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True)[:1000])
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        tag_slug = Tag.objects.values_list('slug', flat=True).first()
+        ingredient_ids = list(
+            Ingredient.objects.values_list('pk', flat=True)[:1000]
+        )
+        ingredient = Ingredient.objects.values_list('name', flat=True).first()
+        version = catalogues['ingredients'].get_snapshot().version
+        catalogue_path = reverse('catalogue', args=('ingredients', version))
+        # Запросы идут от собственных пользователей замера: строки
+        # существующих пользователей не меняются. Читающий получает
+        # избранное, покупки и подписки, пишущий каждый запрос добавления
+        # отменяет запросом удаления по тому же номеру.
+        user, token = self.create_bench_user(run, 'reader')
+        writer, writer_token = self.create_bench_user(run, 'writer')
+        for recipe_id in rng.sample(
+            recipe_ids, min(READER_LINKS, len(recipe_ids))
+        ):
+            FavoriteRecipe.objects.create(user=user, recipe_id=recipe_id)
+            ShoppingCart.objects.create(user=user, recipe_id=recipe_id)
+        for author_id in rng.sample(
+            user_ids, min(READER_LINKS, len(user_ids))
+        ):
+            Subscribe.objects.create(user=user, author_id=author_id)
+        targets = rng.sample(recipe_ids, min(requests, len(recipe_ids)))
+        authors = rng.sample(user_ids, min(requests, len(user_ids)))
+
+        def recipe_path(action):
+            return lambda number: (
+                f'/api/recipes/{targets[number % len(targets)]}/{action}/'
+            )
+
+        def subscribe_path(number):
+            return f'/api/users/{authors[number % len(authors)]}/subscribe/'
+
+        image = 'data:image/png;base64,' + base64.b64encode(
+            seeding.PNG
+        ).decode()
+        created = {}
+        tokens = {}
+
+        def recipe_data(number):
+            return {
+                'name': f'Замер {run} {number}',
+                'text': 'Рецепт для замера',
+                'cooking_time': rng.randint(5, 180),
+                'image': image,
+                'tags': rng.sample(tag_ids, min(2, len(tag_ids))),
+                'ingredients': [
+                    {'id': pk, 'amount': rng.randint(1, 500)}
+                    for pk in rng.sample(
+                        ingredient_ids, min(10, len(ingredient_ids))
+                    )
+                ],
+            }
+
+        def update_data(number):
+            data = recipe_data(number)
+            del data['image']
+            return data
+
+        def created_path(number):
+            return f'/api/recipes/{created.get(number)}/'
+
+        def collect_recipe(number, response):
+            created[number] = response.json()['id']
+
+        def user_data(number):
+            return {
+                'email': f'bench-{run}-{number}@example.com',
+                'username': f'bench-{run}-{number}',
+                'first_name': 'Имя',
+                'last_name': 'Фамилия',
+                'password': BENCH_PASSWORD,
+            }
+
+        def login_data(number):
+            return {
+                'email': f'bench-{run}-{number}@example.com',
+                'password': BENCH_PASSWORD,
+            }
+
+        def collect_token(number, response):
+            tokens[number] = response.json()['auth_token']
+
+        return [
+            Endpoint('recipes_list', 'get', '/api/recipes/'),
+            Endpoint('recipes_list_auth', 'get', '/api/recipes/', token),
+            Endpoint(
+                'recipes_list_tag', 'get', f'/api/recipes/?tags={tag_slug}'
+            ),
+            Endpoint(
+                'recipes_list_favorited', 'get',
+                '/api/recipes/?is_favorited=1', token
+            ),
+            Endpoint(
+                'recipes_search', 'get', '/api/recipes/?search=рецепт'
+            ),
+            Endpoint(
+                'recipes_detail', 'get',
+                lambda number: f'/api/recipes/{rng.choice(recipe_ids)}/'
+            ),
+            Endpoint('tags_list', 'get', '/api/tags/'),
+            Endpoint(
+                'tags_detail', 'get',
+                lambda number: f'/api/tags/{rng.choice(tag_ids)}/'
+            ),
+            Endpoint('ingredients_list', 'get', '/api/ingredients/'),
+            Endpoint(
+                'ingredients_detail', 'get',
+                lambda number: (
+                    f'/api/ingredients/{rng.choice(ingredient_ids)}/'
+                )
+            ),
+            Endpoint(
+                'ingredients_search', 'get',
+                f'/api/ingredients/?name={ingredient[:3]}'
+            ),
+            Endpoint('catalogue', 'get', '/api/catalogue/'),
+            Endpoint('catalogue_version', 'get', catalogue_path),
+            Endpoint('users_list', 'get', '/api/users/'),
+            Endpoint(
+                'users_detail', 'get',
+                lambda number: f'/api/users/{rng.choice(user_ids)}/', token
+            ),
+            Endpoint('users_me', 'get', '/api/users/me/', token),
+            Endpoint(
+                'subscriptions', 'get', '/api/users/subscriptions/', token
+            ),
+            Endpoint(
+                'shopping_cart_summary', 'get',
+                '/api/recipes/shopping_cart_summary/', token
+            ),
+            Endpoint(
+                'download_shopping_cart', 'get',
+                '/api/recipes/download_shopping_cart/', token
+            ),
+            Endpoint(
+                'favorite_add', 'post', recipe_path('favorite'), writer_token,
+                expected=(201,)
+            ),
+            Endpoint(
+                'favorite_remove', 'delete', recipe_path('favorite'),
+                writer_token, expected=(204,)
+            ),
+            Endpoint(
+                'shopping_cart_add', 'post', recipe_path('shopping_cart'),
+                writer_token, expected=(201,)
+            ),
+            Endpoint(
+                'shopping_cart_remove', 'delete',
+                recipe_path('shopping_cart'), writer_token, expected=(204,)
+            ),
+            Endpoint(
+                'subscribe', 'post', subscribe_path, writer_token,
+                expected=(201,)
+            ),
+            Endpoint(
+                'unsubscribe', 'delete', subscribe_path, writer_token,
+                expected=(204,)
+            ),
+            Endpoint(
+                'recipe_create', 'post', '/api/recipes/', writer_token,
+                recipe_data, expected=(201,), collect=collect_recipe
+            ),
+            Endpoint(
+                'recipe_update', 'patch', created_path, writer_token,
+                update_data
+            ),
+            Endpoint(
+                'recipe_delete', 'delete', created_path, writer_token,
+                expected=(204,)
+            ),
+            Endpoint(
+                'users_register', 'post', '/api/users/', data=user_data,
+                expected=(201,)
+            ),
+            Endpoint(
+                'token_login', 'post', '/api/auth/token/login/',
+                data=login_data, collect=collect_token
+            ),
+            Endpoint(
+                'token_logout', 'post', '/api/auth/token/logout/',
+                tokens.get, expected=(204,)
+            ),
+        ]
+
+    def run(self, executor, endpoint, requests):
+        started = time.perf_counter()
+        samples = list(executor.map(
+            lambda number: measure(endpoint, number), range(requests)
+        ))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        queries = [sample[2] for sample in samples if sample[2] is not None]
+        errors = sum(
+            1 for sample in samples if sample[1] not in endpoint.expected
+        )
+        return {
+            'method': endpoint.method.upper(),
+            'requests': requests,
+            'errors': errors,
+            'throughput': round(requests / elapsed, 1),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'max': round(latencies[-1], 2),
+            },
+            'queries': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            } if queries else None,
+        }
+
+    @staticmethod
+    def report(name, result):
+        latency = result['latency_ms']
+        queries = result['queries'] or {'max': '-'}
+        print(
+            f'{name:<24} {result["throughput"]:>8} зап/с  '
+            f'p50 {latency["p50"]:>7} мс  p95 {latency["p95"]:>7} мс  '
+            f'p99 {latency["p99"]:>7} мс  запросов к БД {queries["max"]}  '
+            f'ошибок {result["errors"]}'
+        )
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
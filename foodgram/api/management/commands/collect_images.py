@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes import images
+from recipes.models import Recipe, StoredImage
+
+
+class Command(BaseCommand):
+    """Команда для удаления файлов изображений без ссылок."""
+
+    help = 'Удаление изображений, на которые не ссылаются рецепты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Сколько часов файл должен пробыть без ссылок'
+        )
+        parser.add_argument(
+            '--scan', action='store_true',
+            help='Отметить неучтённые файлы из каталога изображений'
+        )
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        storage = Recipe._meta.get_field('image').storage
+        if kwargs['scan']:
+            self.scan(storage, batch_size)
+        released_before = timezone.now() - timedelta(
+            hours=kwargs['grace_hours']
+        )
+        checked = deleted = 0
+        while True:
+            batch_checked, batch_deleted = images.collect_garbage(
+                storage, released_before, batch_size
+            )
+            checked += batch_checked
+            deleted += batch_deleted
+            if batch_checked < batch_size:
+                break
+        print(f'Проверено файлов: {checked}, удалено: {deleted}')
+
+    def scan(self, storage, batch_size):
+        upload_to = Recipe._meta.get_field('image').upload_to
+        if not storage.exists(upload_to):
+            return
+        batch = []
+        found = 0
+        for name in images.find_files(storage, upload_to):
+            batch.append(name)
+            if len(batch) == batch_size:
+                found += self.register(batch)
+                batch = []
+        found += self.register(batch)
+        print(f'Найдено неучтённых файлов: {found}')
+
+    def register(self, names):
+        known = set(StoredImage.objects.filter(
+            name__in=names
+        ).values_list('name', flat=True))
+        new = [name for name in names if name not in known]
+        images.release(new)
+        return len(new)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Ingredient, Recipe, normalize_search
+
+
+class Command(BaseCommand):
+    """Команда для заполнения нормализованных названий для поиска."""
+
+    help = 'Заполнение полей поиска ингредиентов и рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        for model in (Ingredient, Recipe):
+            changed = []
+            total = 0
+            for obj in model.objects.only(
+                'id', 'name', 'search_name'
+            ).order_by('pk').iterator(chunk_size=batch_size):
+                search_name = normalize_search(obj.name)
+                if obj.search_name != search_name:
+                    obj.search_name = search_name
+                    changed.append(obj)
+                if len(changed) >= batch_size:
+                    model.objects.bulk_update(changed, ('search_name',))
+                    total += len(changed)
+                    changed = []
+            model.objects.bulk_update(changed, ('search_name',))
+            total += len(changed)
+            print(f'{model._meta.verbose_name_plural}: обновлено {total}')
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Команда для создания уменьшенных копий изображений рецептов."""
+
+    help = 'Создание копий изображений рецептов, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=max(settings.IMAGE_VARIANT_WORKERS, 1)
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать копии и для готовых изображений'
+        )
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        force = kwargs['force']
+        recipes = Recipe.objects.exclude(image='')
+        if not force:
+            recipes = recipes.exclude(variants_image=F('image'))
+        recipes = recipes.order_by().values_list('pk', 'image').iterator(
+            chunk_size=batch_size
+        )
+        done = 0
+        with ThreadPoolExecutor(max_workers=kwargs['workers']) as executor:
+            batch = list(islice(recipes, batch_size))
+            while batch:
+                done += sum(executor.map(
+                    lambda row: images.generate_in_worker(*row, force),
+                    batch
+                ))
+                batch = list(islice(recipes, batch_size))
+        print(f'Созданы копии изображений рецептов: {done}')
@@ -2,8 +2,10 @@ import csv
 
 from django.core.management.base import BaseCommand
 
+from api.cache import bump_versions
+from api.ingredient_index import INGREDIENTS_VERSION
 from foodgram.settings import CSV_FILES_DIR
-from recipes.models import Ingredient
+from recipes.models import Ingredient, normalize_search
 
 
 class Command(BaseCommand):
@@ -21,9 +23,11 @@ class Command(BaseCommand):
                 Ingredient(
                     name=row[0],
                     measurement_unit=row[1],
+                    search_name=normalize_search(row[0]),
                 )
                 for row in reader
             ]
             Ingredient.objects.bulk_create(ingredients)
+        bump_versions((INGREDIENTS_VERSION,))
         print('Ингредиенты в базу данных загружены')
         print('ADD', Ingredient.objects.count(), 'Ingredient')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from recipes.models import Recipe, RecipeIngredient
+from recipes.search import clear_index, create_index, fill_index
+
+
+class Command(BaseCommand):
+    """Команда для перестроения полнотекстового индекса рецептов."""
+
+    help = 'Перестроение полнотекстового индекса рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **kwargs):
+        create_index(connection)
+        # Индекс перезаполняется на месте в одной транзакции: до её
+        # фиксации поиск продолжает работать по прежним записям.
+        with transaction.atomic():
+            clear_index(connection)
+            total = fill_index(
+                connection,
+                Recipe.objects.all(),
+                RecipeIngredient.objects.all(),
+                kwargs['batch_size']
+            )
+        print('Проиндексировано рецептов:', total)
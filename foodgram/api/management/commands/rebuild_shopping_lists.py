@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from recipes import shopping_list
+from recipes.models import ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    """Команда для проверки и пересборки списков покупок."""
+
+    help = 'Проверка и пересборка суммарных списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только показать расхождения, ничего не меняя'
+        )
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list('user_id', flat=True))
+            | set(ShoppingListItem.objects.values_list('user_id', flat=True))
+        )
+        broken = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            expected = shopping_list.expected_items(batch)
+            current = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingListItem.objects.filter(
+                    user_id__in=batch
+                ).values_list('user_id', 'ingredient_id', 'amount')
+            }
+            mismatched = {
+                user_id
+                for (user_id, _), _ in expected.items() ^ current.items()
+            }
+            broken += len(mismatched)
+            if mismatched and not kwargs['check']:
+                shopping_list.rebuild(mismatched)
+        action = 'найдено' if kwargs['check'] else 'исправлено'
+        print(f'Списков покупок с расхождениями {action}: {broken}')
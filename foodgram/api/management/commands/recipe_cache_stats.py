@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_stats
+
+
+class Command(BaseCommand):
+    """Команда для вывода статистики кэша рецептов."""
+
+    help = 'Статистика попаданий в кэш рецептов'
+
+    def handle(self, *args, **kwargs):
+        stats = get_stats()
+        print('Попаданий:', stats['hits'])
+        print('Промахов:', stats['misses'])
+        print(f"Доля попаданий: {stats['hit_rate']:.2%}")
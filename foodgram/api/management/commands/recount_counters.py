@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from recipes.counters import COUNTERS, actual_count
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта денормализованных счётчиков."""
+
+    help = 'Пересчёт счётчиков рецептов, избранного и списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        for model, counter, related_model, field in COUNTERS:
+            actual = actual_count(related_model, field)
+            bounds = model.objects.aggregate(first=Min('pk'), last=Max('pk'))
+            fixed = 0
+            if bounds['first'] is not None:
+                # Диапазоны первичного ключа: каждый UPDATE сам находит
+                # и исправляет расхождения, список строк в память
+                # не загружается.
+                for start in range(
+                    bounds['first'], bounds['last'] + 1, batch_size
+                ):
+                    fixed += model.objects.filter(
+                        pk__gte=start, pk__lt=start + batch_size
+                    ).exclude(**{counter: actual}).update(**{counter: actual})
+            print(
+                f'{model._meta.verbose_name_plural}.{counter}: '
+                f'исправлено {fixed}'
+            )
@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import seeding
+
+
+class Command(BaseCommand):
+    """Команда для генерации больших объёмов синтетических данных."""
+
+    help = (
+        'Генерация пользователей, подписок, рецептов, избранного и списков '
+        'покупок с неравномерной популярностью'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=50000)
+        parser.add_argument('--subscriptions', type=int, default=100000)
+        parser.add_argument('--favorites', type=int, default=500000)
+        parser.add_argument('--carts', type=int, default=50000)
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='При том же значении и размерах данные повторяются'
+        )
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='Показатель Zipf: чем больше, тем сильнее перекос'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Строк в одной транзакции'
+        )
+        parser.add_argument(
+            '--skip-maintenance', action='store_true',
+            help='Не пересчитывать счётчики, поисковый индекс и списки'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['users'] < 1 and (
+            kwargs['recipes'] or kwargs['subscriptions']
+            or kwargs['favorites'] or kwargs['carts']
+        ):
+            raise CommandError('Для рецептов и связей нужны пользователи')
+        if kwargs['recipes'] < 1 and (kwargs['favorites'] or kwargs['carts']):
+            raise CommandError('Для избранного и покупок нужны рецепты')
+        if kwargs['exponent'] <= 0:
+            raise CommandError('Показатель Zipf должен быть больше нуля')
+        started = time.perf_counter()
+        seeding.seed(
+            users=kwargs['users'],
+            recipes=kwargs['recipes'],
+            subscriptions=kwargs['subscriptions'],
+            favorites=kwargs['favorites'],
+            carts=kwargs['carts'],
+            seed=kwargs['seed'],
+            exponent=kwargs['exponent'],
+            batch_size=kwargs['batch_size'],
+            chunk_size=kwargs['chunk_size'],
+            maintenance=not kwargs['skip_maintenance'],
+        )
+        print(f'Данные созданы за {time.perf_counter() - started:.1f} с')
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+SCHEMA = (
+    'CREATE TABLE recipe (id INTEGER PRIMARY KEY, name TEXT, text TEXT)',
+    'CREATE TABLE favorite (id INTEGER PRIMARY KEY, user_id INTEGER, '
+    'recipe_id INTEGER REFERENCES recipe (id), UNIQUE (user_id, recipe_id))',
+    'CREATE INDEX favorite_recipe ON favorite (recipe_id)',
+)
+READ_SQL = (
+    'SELECT recipe.id, recipe.name, recipe.text, COUNT(favorite.id) '
+    'FROM recipe LEFT JOIN favorite ON favorite.recipe_id = recipe.id '
+    'WHERE recipe.id BETWEEN ? AND ? GROUP BY recipe.id'
+)
+PAGE_SIZE = 6
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'busy_timeout': 5000,
+}
+
+
+class Command(BaseCommand):
+    """Сравнение пропускной способности SQLite с профилем и без него."""
+
+    help = (
+        'Параллельные чтения и записи во временную базу SQLite '
+        'с параметрами по умолчанию и с SQLITE_PRAGMAS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--recipes', type=int, default=10000)
+
+    def handle(self, *args, **kwargs):
+        profiles = (
+            ('по умолчанию', DEFAULT_PRAGMAS),
+            ('SQLITE_PRAGMAS', settings.SQLITE_PRAGMAS or DEFAULT_PRAGMAS),
+        )
+        for title, pragmas in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                self.create_database(path, kwargs['recipes'])
+                result = self.run(path, pragmas, kwargs)
+            seconds = kwargs['seconds']
+            print(
+                f'{title}: чтений {result["reads"] / seconds:.0f}/с, '
+                f'записей {result["writes"] / seconds:.0f}/с, '
+                f'ошибок блокировки {result["locked"]}'
+            )
+
+    @staticmethod
+    def connect(path, pragmas):
+        connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        for name, value in pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def create_database(self, path, recipes):
+        connection = self.connect(path, {})
+        for sql in SCHEMA:
+            connection.execute(sql)
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO recipe (id, name, text) VALUES (?, ?, ?)',
+            ((pk, f'Рецепт {pk}', 'Описание ' * 20)
+             for pk in range(1, recipes + 1))
+        )
+        connection.execute('COMMIT')
+        connection.close()
+
+    def run(self, path, pragmas, options):
+        recipes = options['recipes']
+        deadline = time.monotonic() + options['seconds']
+        result = {'reads': 0, 'writes': 0, 'locked': 0}
+        lock = threading.Lock()
+
+        def reader(number):
+            connection = self.connect(path, pragmas)
+            reads = 0
+            while time.monotonic() < deadline:
+                start = (reads * PAGE_SIZE + number) % recipes + 1
+                connection.execute(
+                    READ_SQL, (start, start + PAGE_SIZE - 1)
+                ).fetchall()
+                reads += 1
+            connection.close()
+            with lock:
+                result['reads'] += reads
+
+        def writer(number):
+            connection = self.connect(path, pragmas)
+            writes = locked = 0
+            while time.monotonic() < deadline:
+                recipe_id = (writes * 7919 + number) % recipes + 1
+                try:
+                    connection.execute(
+                        'INSERT OR IGNORE INTO favorite (user_id, recipe_id) '
+                        'VALUES (?, ?)', (number, recipe_id)
+                    )
+                    connection.execute(
+                        'DELETE FROM favorite WHERE user_id = ? '
+                        'AND recipe_id = ?', (number, recipe_id - 1)
+                    )
+                    writes += 2
+                except sqlite3.OperationalError:
+                    locked += 1
+            connection.close()
+            with lock:
+                result['writes'] += writes
+                result['locked'] += locked
+
+        threads = [
+            threading.Thread(target=reader, args=(number,))
+            for number in range(options['readers'])
+        ] + [
+            threading.Thread(target=writer, args=(number,))
+            for number in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
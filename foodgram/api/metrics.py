@@ -0,0 +1,198 @@
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+state = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Действие выполнило больше запросов к базе, чем заявлено."""
+
+
+class RequestMetrics:
+    """Счётчики одного запроса: запросы к базе и время этапов."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.view_started = None
+        self.view_time = None
+        self.render_started = None
+        self.render_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    @contextmanager
+    def serializing(self):
+        """Время вывода сериализатора; вложенные вызовы не суммируются."""
+
+        self.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.serializer_depth -= 1
+            if not self.serializer_depth:
+                self.serializer_time += time.perf_counter() - started
+
+    def as_dict(self):
+        total = time.perf_counter() - self.started
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'view_ms': round((self.view_time or 0) * 1000, 2),
+            'serializer_ms': round(self.serializer_time * 1000, 2),
+            'render_ms': round(self.render_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+
+
+def timed_representation(to_representation):
+    @functools.wraps(to_representation)
+    def wrapper(self, instance):
+        metrics = getattr(state, 'metrics', None)
+        if metrics is None:
+            return to_representation(self, instance)
+        with metrics.serializing():
+            return to_representation(self, instance)
+    return wrapper
+
+
+class SerializerMetricsMixin:
+    """Время to_representation в метриках текущего запроса.
+
+    Собственный to_representation наследника тоже замеряется: иначе
+    переопределение обходило бы замер.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'to_representation' in cls.__dict__:
+            cls.to_representation = timed_representation(
+                cls.__dict__['to_representation']
+            )
+
+    @timed_representation
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+def get_budget(view_func, method):
+    """Бюджет запросов действия из query_budgets вьюсета."""
+
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower())
+    budgets = getattr(getattr(view_func, 'cls', None), 'query_budgets', {})
+    return action, budgets.get(action)
+
+
+class RequestMetricsMiddleware:
+    """Число запросов к базе и время этапов запроса.
+
+    Этапы: база, представление, вывод сериализаторов и рендеринг.
+    Значения отдаются заголовком Server-Timing и пишутся в журнал строкой
+    JSON. Если действие вьюсета превысило свой бюджет запросов из
+    query_budgets, в журнал пишется предупреждение, а при
+    QUERY_BUDGET_STRICT запрос завершается ошибкой.
+
+    Потоковый ответ выполняет запросы, пока отдаётся тело, уже после
+    заголовков: запросы считаются до конца выдачи, журнал и бюджет
+    проверяются после неё, а Server-Timing не отправляется.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.metrics = state.metrics = RequestMetrics()
+        request.view_action = request.query_budget = None
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            try:
+                response = self.get_response(request)
+            finally:
+                state.metrics = None
+            if response.streaming:
+                response.streaming_content = self.stream(
+                    request, response, response.streaming_content,
+                    stack.pop_all()
+                )
+                return response
+        response['Server-Timing'] = self.finish(request, response)
+        return response
+
+    def stream(self, request, response, content, stack):
+        with stack:
+            yield from content
+        self.finish(request, response)
+
+    def finish(self, request, response):
+        """Журнал и проверка бюджета; возвращает значение Server-Timing."""
+
+        metrics = request.metrics
+        if metrics.view_time is None and metrics.view_started is not None:
+            metrics.view_time = time.perf_counter() - metrics.view_started
+        data = metrics.as_dict()
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'action': request.view_action,
+            'status': response.status_code,
+            **data,
+        }))
+        self.check_budget(request, metrics)
+        return ', '.join((
+            f'db;dur={data["db_ms"]};desc="{data["queries"]} queries"',
+            f'view;dur={data["view_ms"]}',
+            f'serializer;dur={data["serializer_ms"]}',
+            f'render;dur={data["render_ms"]}',
+            f'total;dur={data["total_ms"]}',
+        ))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_action, request.query_budget = get_budget(
+            view_func, request.method
+        )
+        request.metrics.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = request.metrics
+        metrics.view_time = time.perf_counter() - metrics.view_started
+        metrics.render_started = time.perf_counter()
+
+        def rendered(response):
+            metrics.render_time = time.perf_counter() - metrics.render_started
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def check_budget(request, metrics):
+        budget = request.query_budget
+        if budget is None or metrics.queries <= budget:
+            return
+        message = (
+            f'{request.method} {request.path} ({request.view_action}): '
+            f'{metrics.queries} запросов к базе при бюджете {budget}'
+        )
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -1,4 +1,13 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
@@ -6,3 +15,83 @@ class CustomPagination(PageNumberPagination):
 
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class RecipePagination(CustomPagination):
+    """Пагинатор рецептов с режимом курсора.
+
+    Режим включается параметром ``cursor`` (пустое значение — первая
+    страница). Страница выбирается по ключу ``(created_at, id)`` без
+    ``COUNT`` и ``OFFSET``, поэтому глубокие страницы стоят столько же,
+    сколько первая.
+    """
+
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.cursor_ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, id__lt=pk)
+            )
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.last_item = page[-1] if page else None
+        return page
+
+    def decode_cursor(self, request):
+        """Разбор курсора в пару ``(created_at, id)``."""
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            decoded = base64.urlsafe_b64decode(encoded.encode()).decode()
+            created_at, pk = decoded.rsplit('|', 1)
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    @staticmethod
+    def encode_cursor(recipe):
+        """Курсор, указывающий на позицию после рецепта."""
+
+        position = f'{recipe.created_at.isoformat()}|{recipe.pk}'
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.last_item)
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
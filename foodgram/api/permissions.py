@@ -2,7 +2,10 @@ from rest_framework import permissions
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
-    """Права доступа для автора или только на чтение."""
+    """Права доступа для автора или только на чтение.
+
+    Автор сравнивается по идентификатору, строка автора не загружается.
+    """
 
     def has_permission(self, request, view):
         return (request.method in permissions.SAFE_METHODS
@@ -11,7 +14,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         return (
             request.method in permissions.SAFE_METHODS
-            or obj.author == request.user
+            or obj.author_id == request.user.id
         )
 
 
@@ -22,5 +25,6 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         return bool(
-            request.user.is_authenticated and request.user.is_admin
+            request.user.is_authenticated and request.user.is_staff
         )
+
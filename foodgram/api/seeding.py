@@ -0,0 +1,271 @@
+import itertools
+import math
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+
+from recipes import images
+from recipes.models import (
+    FavoriteRecipe, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag,
+    TagRecipe, normalize_search
+)
+from users.models import Subscribe, User
+
+
+SEED_PASSWORD = 'seed-password'
+# Прозрачный PNG 1x1.
+PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+    '0000000d49444154789c6360606060000000050001a5f645400000000049454e44'
+    'ae426082'
+)
+INGREDIENTS_PER_RECIPE = (3, 10)
+TAGS_PER_RECIPE = (1, 2)
+
+
+class Zipf:
+    """Ключи first..first+n-1, k-й по популярности выпадает с весом 1/k^s.
+
+    Ранг получается обращением непрерывной функции распределения, поэтому
+    память не зависит от n. Ранги переставлены умножением на взаимно
+    простое с n число: популярные строки разбросаны по всей таблице,
+    а не собраны в её начале.
+    """
+
+    def __init__(self, rng, n, exponent, first=0):
+        self.rng = rng
+        self.n = n
+        self.first = first
+        self.exponent = exponent
+        self.step = 1
+        if n > 2:
+            self.step = rng.randrange(1, n)
+            while math.gcd(self.step, n) != 1:
+                self.step = rng.randrange(1, n)
+        self.shift = rng.randrange(n) if n else 0
+
+    def rank(self):
+        u = self.rng.random()
+        if abs(self.exponent - 1) < 1e-9:
+            x = self.n ** u
+        else:
+            power = 1 - self.exponent
+            x = ((self.n ** power - 1) * u + 1) ** (1 / power)
+        return min(int(x), self.n) - 1
+
+    def __call__(self):
+        return self.first + (self.rank() * self.step + self.shift) % self.n
+
+    def sample(self, count, exclude=None):
+        """count разных ключей, чаще популярные."""
+
+        chosen = set()
+        for _ in range(count * 20):
+            if len(chosen) == count:
+                break
+            value = self()
+            if value != exclude:
+                chosen.add(value)
+        return chosen
+
+
+def spread(total, n):
+    """Делит total строк между n владельцами, сумма точно равна total."""
+
+    for number in range(n):
+        yield total * (number + 1) // n - total * number // n
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def insert(model, rows, chunk_size, batch_size):
+    """Вставка потока строк: по транзакции на chunk_size строк.
+
+    В памяти держится одна пачка; журнал запросов режима DEBUG
+    очищается, иначе он хранит тексты тысяч больших INSERT.
+    """
+
+    started = time.perf_counter()
+    total = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        with transaction.atomic():
+            model.objects.bulk_create(chunk, batch_size=batch_size)
+        reset_queries()
+        total += len(chunk)
+    print(
+        f'{model._meta.verbose_name_plural}: {total} '
+        f'за {time.perf_counter() - started:.1f} с'
+    )
+
+
+def load_catalogues():
+    """Ингредиенты и теги из data/, если справочники ещё пусты."""
+
+    if not Ingredient.objects.exists():
+        call_command('ingredients_from_data')
+    if not Tag.objects.exists():
+        call_command('add_tags')
+
+
+def seed_image():
+    """Общее для всех рецептов изображение, сохранённое один раз."""
+
+    image = Recipe().image
+    image.save('seed.png', ContentFile(PNG), save=False)
+    images.track([image.name])
+    return image.name
+
+
+def generate_users(first_id, count):
+    password = make_password(SEED_PASSWORD)
+    for pk in range(first_id, first_id + count):
+        yield User(
+            pk=pk,
+            email=f'seed{pk}@example.com',
+            username=f'seed{pk}',
+            first_name='Имя',
+            last_name='Фамилия',
+            password=password,
+        )
+
+
+def generate_recipes(rng, first_id, count, authors, image):
+    for pk in range(first_id, first_id + count):
+        name = f'Рецепт {pk}'
+        yield Recipe(
+            pk=pk,
+            author_id=authors(),
+            name=name,
+            search_name=normalize_search(name),
+            image=image,
+            text='Описание рецепта',
+            cooking_time=rng.randint(5, 180),
+        )
+
+
+def generate_recipe_ingredients(rng, recipe_ids, ingredient_ids, exponent):
+    popularity = Zipf(rng, len(ingredient_ids), exponent)
+    for recipe_id in recipe_ids:
+        count = min(rng.randint(*INGREDIENTS_PER_RECIPE), len(ingredient_ids))
+        for index in popularity.sample(count):
+            yield RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[index],
+                amount=rng.randint(1, 500),
+            )
+
+
+def generate_recipe_tags(rng, recipe_ids, tag_ids):
+    for recipe_id in recipe_ids:
+        count = min(rng.randint(*TAGS_PER_RECIPE), len(tag_ids))
+        for tag_id in rng.sample(tag_ids, count):
+            yield TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+
+
+def generate_links(model, owner_field, target_field, total, owner_ids,
+                   targets):
+    """Связи без повторов: total строк поровну между владельцами.
+
+    Цели выбираются по популярности; пользователь не подписывается сам
+    на себя.
+    """
+
+    for owner_id, count in zip(owner_ids, spread(total, len(owner_ids))):
+        exclude = owner_id if model is Subscribe else None
+        count = min(count, targets.n - (exclude is not None))
+        for target_id in targets.sample(count, exclude):
+            yield model(**{owner_field: owner_id, target_field: target_id})
+
+
+def reset_sequences(models):
+    """Ключи задавались явно: счётчики ключей в базе нужно сдвинуть."""
+
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def seed(users, recipes, favorites, carts=0, subscriptions=0, seed=0,
+         exponent=1.1, batch_size=1000, chunk_size=10000, maintenance=True):
+    """Синтетические пользователи, подписки, рецепты, избранное и покупки.
+
+    Новые строки получают ключи подряд после существующих, поэтому ни
+    ключи, ни объекты целиком в памяти не держатся. Популярность авторов,
+    рецептов и ингредиентов распределена по Zipf с показателем exponent.
+    У каждой таблицы свой генератор от seed: при том же seed и тех же
+    размерах данные совпадают.
+
+    bulk_create не вызывает сигналы, поэтому после загрузки пересчитываются
+    счётчики, поисковый индекс и списки покупок.
+    """
+
+    def stream(name):
+        return random.Random(f'{seed}:{name}')
+
+    load_catalogues()
+    ingredient_ids = list(
+        Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+    )
+    tag_ids = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+    first_user = next_id(User)
+    first_recipe = next_id(Recipe)
+    user_ids = range(first_user, first_user + users)
+    recipe_ids = range(first_recipe, first_recipe + recipes)
+    insert(User, generate_users(first_user, users), chunk_size, batch_size)
+    authors = Zipf(stream('authors'), users, exponent, first_user)
+    insert(
+        Recipe,
+        generate_recipes(
+            stream('recipes'), first_recipe, recipes, authors, seed_image()
+        ),
+        chunk_size,
+        batch_size
+    )
+    insert(
+        RecipeIngredient,
+        generate_recipe_ingredients(
+            stream('ingredients'), recipe_ids, ingredient_ids, exponent
+        ),
+        chunk_size,
+        batch_size
+    )
+    insert(
+        TagRecipe,
+        generate_recipe_tags(stream('tags'), recipe_ids, tag_ids),
+        chunk_size,
+        batch_size
+    )
+    for model, target, total, targets in (
+        (Subscribe, 'author_id', subscriptions,
+         Zipf(stream('subscriptions'), users, exponent, first_user)),
+        (FavoriteRecipe, 'recipe_id', favorites,
+         Zipf(stream('favorites'), recipes, exponent, first_recipe)),
+        (ShoppingCart, 'recipe_id', carts,
+         Zipf(stream('carts'), recipes, exponent, first_recipe)),
+    ):
+        insert(
+            model,
+            generate_links(
+                model, 'user_id', target, total, user_ids, targets
+            ),
+            chunk_size,
+            batch_size
+        )
+    reset_sequences([User, Recipe])
+    if maintenance:
+        call_command('recount_counters')
+        call_command('rebuild_search_index')
+        call_command('rebuild_shopping_lists')
@@ -1,29 +1,119 @@
 #!-*-coding:utf-8-*-
 import base64
+import binascii
+import json
+from collections import OrderedDict
 
+from django.conf import settings
 from django.core.files.base import ContentFile
-from djoser.serializers import UserCreateSerializer, UserSerializer
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from djoser.serializers import UserCreateSerializer
+from PIL import Image
 from rest_framework import serializers
+from rest_framework.utils import html
 
+from api import cache
+from api.metrics import SerializerMetricsMixin
+from recipes import images, shopping_list
 from recipes.models import (
     Ingredient, Recipe, Tag, RecipeIngredient,
-    FavoriteRecipe, ShoppingCart, TagRecipe
+    FavoriteRecipe, ShoppingCart, ShoppingListItem
 )
 from users.models import Subscribe, User
 
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение строкой base64 или файлом из multipart-запроса.
+
+    Размер проверяется до декодирования: у строки base64 он вычисляется
+    по её длине. Ширина и высота читаются из заголовка изображения до
+    полной проверки файла.
+    """
+
+    default_error_messages = {
+        'invalid_base64': 'Неверные данные изображения в base64.',
+        'max_file_size': (
+            'Размер изображения не должен превышать {max_file_size} байт.'
+        ),
+        'max_dimension': (
+            'Ширина и высота изображения не должны превышать '
+            '{max_dimension} пикселей.'
+        ),
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.max_file_size = kwargs.pop(
+            'max_file_size', settings.IMAGE_UPLOAD_MAX_SIZE
+        )
+        self.max_dimension = kwargs.pop(
+            'max_dimension', settings.IMAGE_UPLOAD_MAX_DIMENSION
+        )
+        super().__init__(*args, **kwargs)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
+            data = self.decode(data)
+        elif getattr(data, 'size', 0) > self.max_file_size:
+            self.fail('max_file_size', max_file_size=self.max_file_size)
+        self.check_dimensions(data)
         return super().to_internal_value(data)
 
+    def decode(self, data):
+        format, separator, imgstr = data.partition(';base64,')
+        if not separator:
+            self.fail('invalid_base64')
+        size = len(imgstr) * 3 // 4 - imgstr[-2:].count('=')
+        if size > self.max_file_size:
+            self.fail('max_file_size', max_file_size=self.max_file_size)
+        try:
+            content = base64.b64decode(imgstr)
+        except binascii.Error:
+            self.fail('invalid_base64')
+        ext = format.split('/')[-1]
+        return ContentFile(content, name='temp.' + ext)
+
+    def check_dimensions(self, data):
+        if not hasattr(data, 'seek'):
+            return
+        try:
+            with Image.open(data) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            self.fail('max_dimension', max_dimension=self.max_dimension)
+        except (OSError, SyntaxError, ValueError):
+            self.fail('invalid_image')
+        finally:
+            data.seek(0)
+        if max(width, height) > self.max_dimension:
+            self.fail('max_dimension', max_dimension=self.max_dimension)
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии изображения рецепта.
+
+    Пока копии не созданы, вместо каждой отдаётся оригинал.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for variant, name in images.variant_names(recipe).items():
+            url = recipe.image.storage.url(name)
+            urls[variant] = (
+                request.build_absolute_uri(url) if request else url
+            )
+        return urls
 
-class CustomRegisterSerializer(UserCreateSerializer):
+
+class CustomRegisterSerializer(SerializerMetricsMixin, UserCreateSerializer):
     username = serializers.RegexField(
         required=True,
         regex=r'^[\w.@+-]+\Z',
@@ -41,7 +131,7 @@ class CustomRegisterSerializer(UserCreateSerializer):
         )
 
 
-class CustomUserSerializer(UserCreateSerializer):
+class CustomUserSerializer(SerializerMetricsMixin, UserCreateSerializer):
     """Сериализатор пользователей."""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -60,6 +150,8 @@ class CustomUserSerializer(UserCreateSerializer):
     def get_is_subscribed(self, obj):
         """Метод проверки подписки"""
 
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
@@ -69,7 +161,9 @@ class CustomUserSerializer(UserCreateSerializer):
         ).exists()
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Сериализатор для вывода ингредиентов."""
 
     class Meta:
@@ -77,7 +171,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SerializerMetricsMixin, serializers.ModelSerializer):
     """Сериализатор тегов."""
 
     class Meta:
@@ -85,7 +179,9 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class RecipeIngredientSerializer(serializers.ModelSerializer):
+class RecipeIngredientSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Сериализатор ингредиентов в рецепте"""
 
     id = serializers.ReadOnlyField(source='ingredient.id')
@@ -98,7 +194,9 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class IngredientCreateInRecipeSerializer(serializers.ModelSerializer):
+class IngredientCreateInRecipeSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Создание ингредиента в рецепте."""
     id = serializers.IntegerField()
     amount = serializers.IntegerField()
@@ -118,9 +216,26 @@ class IngredientCreateInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
-    """Получение списка рецептов."""
-    author = UserSerializer()
+class RecipeListListSerializer(
+    SerializerMetricsMixin, serializers.ListSerializer
+):
+    """Вывод рецептов списком с одним обращением к кэшу."""
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        return self.child.to_representation_many(list(data))
+
+
+class RecipeListSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
+    """Получение списка рецептов.
+
+    Общая для всех пользователей часть рецепта кэшируется по ревизии
+    рецепта, к ней добавляются только флаги текущего пользователя.
+    """
+    author = CustomUserSerializer()
     tags = TagSerializer(many=True)
     ingredients = RecipeIngredientSerializer(
         many=True,
@@ -129,9 +244,13 @@ class RecipeListSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
+
+    user_fields = ('is_favorited', 'is_in_shopping_cart')
 
     class Meta:
         model = Recipe
+        list_serializer_class = RecipeListListSerializer
         fields = (
             'id',
             'name',
@@ -142,32 +261,99 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'cooking_time',
             'is_in_shopping_cart',
             'image',
+            'image_variants',
             'tags',
         )
 
-    def get_is_favorited(self, obj):
-        """Метод добавления в избранное"""
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, recipes):
+        """Представление рецептов из кэша фрагментов."""
 
         request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        return FavoriteRecipe.objects.filter(
-            user=request.user, recipe=obj
-        ).exists()
+        self.set_user_flags(recipes)
+        fragments = cache.get_fragments(
+            request, recipes, self.render_fragments
+        )
+        return [
+            self.add_user_data(fragments[recipe.pk], recipe)
+            for recipe in recipes
+        ]
+
+    def render_fragments(self, recipes):
+        """Общая для всех пользователей часть рецептов."""
+
+        prefetch_related_objects(recipes, *Recipe.objects.detail_lookups())
+        fragments = {}
+        for recipe in recipes:
+            recipe.author.is_subscribed = recipe.author_is_subscribed
+            fragment = super().to_representation(recipe)
+            for field in self.user_fields:
+                del fragment[field]
+            del fragment['author']['is_subscribed']
+            fragments[recipe.pk] = fragment
+        return fragments
+
+    def add_user_data(self, fragment, recipe):
+        data = OrderedDict()
+        for field in self.Meta.fields:
+            if field in self.user_fields:
+                data[field] = getattr(recipe, field)
+            else:
+                data[field] = fragment[field]
+        data['author'] = OrderedDict(
+            fragment['author'], is_subscribed=recipe.author_is_subscribed
+        )
+        return data
 
-    def get_is_in_shopping_cart(self, obj):
-        """Метод добавления в список покупок"""
+    def set_user_flags(self, recipes):
+        """Флаги пользователя для рецептов без аннотаций.
 
+        Рецепты из RecipeQuerySet.with_user_flags уже содержат флаги,
+        для остальных они загружаются тремя запросами на всю пачку.
+        """
+
+        recipes = [
+            recipe for recipe in recipes
+            if not hasattr(recipe, 'is_favorited')
+        ]
+        if not recipes:
+            return
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return ShoppingCart.objects.filter(
-                user=request.user,
-                recipe=obj
-            ).exists()
-        return False
+        favorited = in_cart = subscribed = set()
+        if request is not None and request.user.is_authenticated:
+            user = request.user
+            favorited = set(FavoriteRecipe.objects.filter(
+                user=user, recipe__in=recipes
+            ).values_list('recipe_id', flat=True))
+            in_cart = set(ShoppingCart.objects.filter(
+                user=user, recipe__in=recipes
+            ).values_list('recipe_id', flat=True))
+            subscribed = set(Subscribe.objects.filter(
+                user=user, author__in={recipe.author_id for recipe in recipes}
+            ).values_list('author_id', flat=True))
+        for recipe in recipes:
+            recipe.is_favorited = recipe.pk in favorited
+            recipe.is_in_shopping_cart = recipe.pk in in_cart
+            recipe.author_is_subscribed = recipe.author_id in subscribed
+
+    @staticmethod
+    def get_is_favorited(obj):
+        """Метод добавления в избранное"""
 
+        return obj.is_favorited
 
-class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def get_is_in_shopping_cart(obj):
+        """Метод добавления в список покупок"""
+
+        return obj.is_in_shopping_cart
+
+
+class RecipeCreateUpdateSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Сериализатор для создания и обновления рецептов."""
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
@@ -197,45 +383,120 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         )
         return serializer.data
 
+    def to_internal_value(self, data):
+        if html.is_html_input(data):
+            data = self.parse_form(data)
+        return super().to_internal_value(data)
+
+    @staticmethod
+    def parse_form(data):
+        """Поля multipart-запроса в том виде, в каком они приходят в JSON.
+
+        Ингредиенты передаются строкой JSON, теги — повторяющимся полем
+        или также строкой JSON.
+        """
+
+        parsed = {key: data[key] for key in data}
+        if 'tags' in data:
+            parsed['tags'] = data.getlist('tags')
+            if len(parsed['tags']) == 1 and parsed['tags'][0].startswith('['):
+                parsed['tags'] = parsed['tags'][0]
+        for field in ('tags', 'ingredients'):
+            if isinstance(parsed.get(field), str):
+                try:
+                    parsed[field] = json.loads(parsed[field])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {field: 'Ожидается список в формате JSON.'}
+                    )
+        return parsed
+
     def validate(self, data):
         tags = data.get('tags')
-        if not tags:
+        if not tags and not (self.partial and 'tags' not in data):
             raise serializers.ValidationError({'tags': 'Обязательное поле.'})
-        if len(tags) != len(set(tags)):
+        if tags and len(tags) != len(set(tags)):
             raise serializers.ValidationError(
                 {'tags': 'Теги должны быть уникальными!'}
             )
 
-        ingredients = self.initial_data.get('ingredients')
-        if not ingredients:
+        if (not data.get('ingredients')
+                and not (self.partial and 'ingredients' not in data)):
             raise serializers.ValidationError(
                 {'ingredients': 'Обязательное поле.'}
             )
-
-        ingredient_list = []
-        for ingredient in ingredients:
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError('Ингредиент повторяется.')
-            ingredient_list.append(ingredient)
         return data
 
-    def create_ingredients(self, ingredients, recipe):
-        for element in ingredients:
-            id = element['id']
-            try:
-                ingredient = Ingredient.objects.get(pk=id)
-            except Ingredient.DoesNotExist:
-                raise serializers.ValidationError(
-                    {'ingredients': 'Ингредиент не найден!'}
-                )
-            amount = element['amount']
-            RecipeIngredient.objects.create(
-                ingredient=ingredient, recipe=recipe, amount=amount
+    @staticmethod
+    def validate_ingredients(value):
+        """Проверка ингредиентов одним запросом к базе."""
+
+        ids = [element['id'] for element in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError('Ингредиент повторяется.')
+        found = set(Ingredient.objects.filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: '
+                + ', '.join(str(pk) for pk in missing)
             )
+        return value
+
+    @staticmethod
+    def create_ingredients(ingredients, recipe):
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=element['id'],
+                amount=element['amount']
+            )
+            for element in ingredients
+        ])
+
+    def update_ingredients(self, ingredients, recipe):
+        """Изменяет только отличающиеся строки ингредиентов рецепта."""
+
+        current = {
+            element.ingredient_id: element
+            for element in recipe.recipe_ingredient.all()
+        }
+        amounts = {element['id']: element['amount'] for element in ingredients}
+        deltas = {}
+        removed = current.keys() - amounts.keys()
+        if removed:
+            # Изменения применяются к спискам покупок ниже, одним вызовом.
+            with shopping_list.suspended(recipe.pk):
+                RecipeIngredient.objects.filter(
+                    recipe=recipe, ingredient_id__in=removed
+                ).delete()
+            for ingredient_id in removed:
+                deltas[ingredient_id] = -current[ingredient_id].amount
+        changed = []
+        for ingredient_id, element in current.items():
+            amount = amounts.get(ingredient_id, element.amount)
+            if element.amount != amount:
+                deltas[ingredient_id] = amount - element.amount
+                element.amount = amount
+                changed.append(element)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        created = [
+            element for element in ingredients
+            if element['id'] not in current
+        ]
+        self.create_ingredients(created, recipe)
+        for element in created:
+            deltas[element['id']] = element['amount']
+        if deltas:
+            shopping_list.apply_recipe_changes(recipe.pk, deltas)
 
     def create_tags(self, tags, recipe):
         recipe.tags.set(tags)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -244,18 +505,23 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         self.create_tags(tags, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        TagRecipe.objects.filter(recipe=instance).delete()
-
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
-        self.create_tags(validated_data.pop('tags'), instance)
+        if 'ingredients' in validated_data:
+            self.update_ingredients(
+                validated_data.pop('ingredients'), instance
+            )
+        if 'tags' in validated_data:
+            self.create_tags(validated_data.pop('tags'), instance)
 
         return super().update(instance, validated_data)
 
 
-class AdditionalRecipeSerializer(serializers.ModelSerializer):
+class AdditionalRecipeSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Дополнительный сериализатор для рецептов """
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -263,10 +529,31 @@ class AdditionalRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time'
         )
 
 
+class RecipesLimitSerializer(SerializerMetricsMixin, serializers.Serializer):
+    """Проверка параметра recipes_limit."""
+
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+def get_recipes_limit(request):
+    """Число рецептов автора в ответе или None, если без ограничения."""
+
+    serializer = RecipesLimitSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data.get('recipes_limit')
+
+
+def limit_recipes(recipes, recipes_limit):
+    if recipes_limit is None:
+        return recipes
+    return recipes[:recipes_limit]
+
+
 class SubscribeSerializer(CustomUserSerializer):
     """Сериализатор для модели Subscribe"""
     email = serializers.ReadOnlyField(source='author.email')
@@ -278,7 +565,7 @@ class SubscribeSerializer(CustomUserSerializer):
         read_only=True,
         method_name='get_recipes'
     )
-    recipes_count = serializers.ReadOnlyField(source='author.recipes.count')
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -297,10 +584,10 @@ class SubscribeSerializer(CustomUserSerializer):
     def get_recipes(self, obj):
         """Метод для получения рецептов"""
 
-        recipes = obj.author.recipes.all()
-        recipes_limit = self.context.get('request').GET.get('recipes_limit')
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        recipes = limit_recipes(
+            obj.author.recipes.all(),
+            get_recipes_limit(self.context.get('request'))
+        )
         return AdditionalRecipeSerializer(recipes, many=True).data
 
     def get_is_subscribed(self, obj):
@@ -314,16 +601,16 @@ class SubscribeSerializer(CustomUserSerializer):
         ).exists()
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Сериализатор для модели Subscribe"""
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField(
         read_only=True,
         method_name='get_recipes'
     )
-    recipes_count = serializers.SerializerMethodField(
-        read_only=True
-    )
+    recipes_count = serializers.ReadOnlyField()
     email = serializers.ReadOnlyField()
 
     class Meta:
@@ -342,29 +629,45 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     def get_recipes(self, obj):
         """Метод для получения рецептов"""
 
-        request = self.context.get('request')
-        recipes = obj.recipes.all()
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = limit_recipes(
+                obj.recipes.all(),
+                get_recipes_limit(self.context.get('request'))
+            )
         return AdditionalRecipeSerializer(recipes, many=True).data
 
-    @staticmethod
-    def get_recipes_count(obj):
-        """Метод для получения количества рецептов"""
-
-        return obj.recipes.count()
-
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request:
             return False
         return Subscribe.objects.filter(user=request.user, author=obj).exists()
 
 
-class FavoriteRecipeSerializer(serializers.ModelSerializer):
+class ShoppingListItemSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
+    """Сериализатор ингредиента в списке покупок."""
+
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class FavoriteRecipeSerializer(
+    SerializerMetricsMixin, serializers.ModelSerializer
+):
     """Сериализатор для добавления в избранное."""
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -372,5 +675,6 @@ class FavoriteRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time'
         )
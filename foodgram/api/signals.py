@@ -0,0 +1,161 @@
+import threading
+
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_save
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import cache
+from api.authentication import token_cache
+from api.ingredient_index import INGREDIENTS_VERSION
+from recipes.models import (
+    FavoriteRecipe, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag,
+    TagRecipe
+)
+from users.models import Subscribe, User
+
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+pending = threading.local()
+
+
+def recipes_changed(recipe_ids=(), author_ids=(), tag_ids=(),
+                    tag_slugs=(), touch=True):
+    """Отложенный до фиксации транзакции сброс кэша рецептов.
+
+    Изменения копятся за всю транзакцию, поэтому массовые операции над
+    строками рецепта дают один сброс, а не по одному на строку.
+    """
+
+    changes = getattr(pending, 'changes', None)
+    if changes is None:
+        changes = pending.changes = {
+            'touch': set(), 'recipes': set(), 'authors': set(),
+            'tags': set(), 'slugs': set(),
+        }
+    if touch:
+        changes['touch'].update(recipe_ids)
+    changes['recipes'].update(recipe_ids)
+    changes['authors'].update(author_ids)
+    changes['tags'].update(tag_ids)
+    changes['slugs'].update(tag_slugs)
+    transaction.on_commit(flush_changes)
+
+
+def flush_changes():
+    changes = getattr(pending, 'changes', None)
+    if not changes:
+        return
+    pending.changes = None
+    if changes['touch']:
+        Recipe.objects.filter(pk__in=changes['touch']).touch()
+    if changes['tags']:
+        changes['slugs'].update(Tag.objects.filter(
+            pk__in=changes['tags']
+        ).values_list('slug', flat=True))
+    cache.invalidate(
+        recipe_ids=changes['recipes'],
+        author_ids=changes['authors'],
+        tag_slugs=changes['slugs']
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    recipes_changed(
+        (instance.pk,), author_ids=(instance.author_id,), touch=False
+    )
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    recipes_changed((instance.recipe_id,))
+
+
+@receiver((post_save, post_delete), sender=TagRecipe)
+def tag_recipe_changed(sender, instance, **kwargs):
+    recipes_changed((instance.recipe_id,), tag_ids=(instance.tag_id,))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+    if reverse:
+        recipe_ids = (
+            pk_set if pk_set is not None
+            else instance.recipes.values_list('pk', flat=True)
+        )
+        recipes_changed(recipe_ids, tag_slugs=(instance.slug,))
+        return
+    recipes_changed((instance.pk,), tag_ids=pk_set or ())
+
+
+@receiver(pre_save, sender=Tag)
+def remember_tag_slug(sender, instance, **kwargs):
+    instance.previous_slug = Tag.objects.filter(
+        pk=instance.pk
+    ).values_list('slug', flat=True).first()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    cache.bump_versions((cache.TAGS_VERSION,))
+    slugs = {instance.slug, getattr(instance, 'previous_slug', None)}
+    slugs.discard(None)
+    recipes_changed(
+        Recipe.objects.filter(tags=instance).values_list('pk', flat=True),
+        tag_slugs=slugs
+    )
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, instance, created=False, **kwargs):
+    cache.bump_versions((INGREDIENTS_VERSION,))
+    if not created:
+        recipes_changed(
+            Recipe.objects.filter(
+                ingredients=instance
+            ).values_list('pk', flat=True)
+        )
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields is not None and not AUTHOR_FIELDS & set(update_fields):
+        return
+    recipes_changed(
+        instance.recipes.values_list('pk', flat=True),
+        author_ids=(instance.pk,)
+    )
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscribe)
+def user_state_changed(sender, instance, **kwargs):
+    cache.bump_versions((cache.user_state(instance.user_id),))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(user_logged_out)
+def user_logged_out_everywhere(sender, user, **kwargs):
+    if user is not None:
+        token_cache.invalidate_user(user.pk)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Блокировка пользователя и изменение его данных.
+    if not created:
+        token_cache.invalidate_user(instance.pk)
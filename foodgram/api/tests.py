@@ -0,0 +1,886 @@
+import tempfile
+import time
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from api import seeding
+from api.authentication import token_cache
+from api.cache import get_stats
+from api.db import ReplicaMiddleware, ReplicaRouter, configure_sqlite
+from api.metrics import QueryBudgetExceeded, RequestMetrics
+from api.views import RecipeViewSet
+from recipes import images, shopping_list
+from recipes.models import (
+    FavoriteRecipe, Ingredient, Recipe, RecipeIngredient, ShoppingListItem,
+    StoredImage, Tag
+)
+from users.models import User
+
+
+RECIPE_IMAGE = 'recipes/media/recipe.png'
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com',
+        username=name,
+        first_name='Имя',
+        last_name='Фамилия',
+        password='secret-password',
+    )
+
+
+def file_cache(directory):
+    """Общий для процессов кэш без внешних сервисов."""
+
+    return override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': directory,
+    }})
+
+
+def use_temporary_media(test):
+    """Медиафайлы теста во временном каталоге, с изображением рецептов.
+
+    В транзакционных тестах копии изображений создаются после фиксации,
+    поэтому файл изображения должен существовать.
+    """
+
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    media = override_settings(MEDIA_ROOT=directory.name)
+    media.enable()
+    test.addCleanup(media.disable)
+    default_storage.save(RECIPE_IMAGE, ContentFile(seeding.PNG))
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class TokenCacheTests(APITestCase):
+    """Отозванный токен не проходит, даже если запись ещё в кэше."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.entries.clear()
+        self.user = create_user('user')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('users-me')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(self.token.key, token_cache.entries)
+
+    def test_logout(self):
+        response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def revalidated_get(self, url=None):
+        """Запрос после интервала, когда запись сверяется с базой."""
+
+        later = time.monotonic() + settings.TOKEN_CACHE_REVALIDATE + 1
+        with mock.patch('api.authentication.time.monotonic') as monotonic:
+            monotonic.return_value = later
+            return self.client.get(url or self.url)
+
+    def test_token_deleted_in_other_process(self):
+        # Удаление без сигналов: запись в кэше этого процесса остаётся,
+        # как у процесса, который не обрабатывал выход.
+        tokens = Token.objects.filter(pk=self.token.pk)
+        tokens._raw_delete(tokens.db)
+        response = self.revalidated_get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_deactivated_in_other_process(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.revalidated_get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_process_cache_hit_skips_database(self):
+        url = reverse('tags-list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            response = self.revalidated_get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_shared_cache_hit_skips_database(self):
+        with tempfile.TemporaryDirectory() as directory, file_cache(
+            directory
+        ):
+            token_cache.entries.clear()
+            self.client.get(reverse('tags-list'))
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('tags-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CatalogueRefreshTests(APITestCase):
+    """Справочники, изменённые другим процессом, видны без перезапуска."""
+
+    def setUp(self):
+        cache.clear()
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+
+    def later(self):
+        later = time.monotonic() + settings.CATALOGUE_REFRESH_INTERVAL + 1
+        return mock.patch('api.cache.time.monotonic', return_value=later)
+
+    def test_tags_added_elsewhere(self):
+        url = reverse('tags-list')
+        self.client.get(url)
+        # bulk_create не вызывает сигналов и не меняет версий, как
+        # запись, сделанная другим процессом.
+        Tag.objects.bulk_create([
+            Tag(name='Обед', color='#49B64E', slug='lunch')
+        ])
+        self.assertEqual(len(self.client.get(url).data), 1)
+        with self.later():
+            self.assertEqual(len(self.client.get(url).data), 2)
+
+    def test_ingredients_added_elsewhere(self):
+        url = reverse('ingredients-list')
+        self.client.get(url, {'name': 'со'})
+        Ingredient.objects.bulk_create([
+            Ingredient(name='соль', measurement_unit='г')
+        ])
+        self.assertEqual(self.client.get(url, {'name': 'со'}).data, [])
+        with self.later():
+            response = self.client.get(url, {'name': 'со'})
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data], ['соль']
+        )
+
+    def test_unchanged_rebuild_keeps_version(self):
+        url = reverse('catalogue-versions')
+        version = self.client.get(url).data['tags']['version']
+        with self.later():
+            self.assertEqual(
+                self.client.get(url).data['tags']['version'], version
+            )
+
+
+class CounterTests(APITestCase):
+    """Счётчики растут при добавлении и пересчитываются при удалении."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.reader = create_user('reader')
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            image=RECIPE_IMAGE,
+            text='Описание',
+            cooking_time=10,
+        )
+
+    def test_counters_follow_rows(self):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        favorite = FavoriteRecipe.objects.create(
+            user=self.reader, recipe=self.recipe
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        favorite.delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_delete_fixes_drift(self):
+        FavoriteRecipe.objects.create(user=self.reader, recipe=self.recipe)
+        favorite = FavoriteRecipe.objects.create(
+            user=self.author, recipe=self.recipe
+        )
+        # Расхождение, как после записи в обход сигналов.
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=0)
+        favorite.delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, QUERY_BUDGET_STRICT=True)
+class ShoppingListTests(APITransactionTestCase):
+    """Правка рецепта в корзинах меняет списки покупок набором запросов."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.author = create_user('author')
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(30)
+        ])
+        self.ingredients = list(Ingredient.objects.order_by('pk'))
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            image=RECIPE_IMAGE,
+            text='Описание',
+            cooking_time=10,
+        )
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=self.recipe, ingredient=ingredient, amount=10
+            )
+            for ingredient in self.ingredients
+        ])
+        self.buyers = [create_user(f'buyer{number}') for number in range(3)]
+        for buyer in self.buyers:
+            self.client.force_authenticate(buyer)
+            self.client.post(
+                reverse('recipes-shopping-cart', args=(self.recipe.pk,))
+            )
+        self.client.force_authenticate(self.author)
+
+    def assertListsRebuilt(self):
+        user_ids = [buyer.pk for buyer in self.buyers]
+        self.assertEqual(
+            shopping_list.expected_items(user_ids),
+            {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingListItem.objects.filter(
+                    user_id__in=user_ids
+                ).values_list('user_id', 'ingredient_id', 'amount')
+            }
+        )
+
+    def patch_ingredients(self, ingredients):
+        return self.client.patch(
+            reverse('recipes-detail', args=(self.recipe.pk,)),
+            {'ingredients': ingredients},
+        )
+
+    def test_trim_ingredients(self):
+        ingredients = [{'id': self.ingredients[0].pk, 'amount': 25}]
+        with self.assertNumQueries(27):
+            response = self.patch_ingredients(ingredients)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListsRebuilt()
+
+    def test_direct_row_changes(self):
+        row = RecipeIngredient.objects.get(
+            recipe=self.recipe, ingredient=self.ingredients[0]
+        )
+        row.amount = 40
+        row.save()
+        self.assertListsRebuilt()
+        row.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г'
+        )
+        row.save()
+        self.assertListsRebuilt()
+        RecipeIngredient.objects.create(
+            recipe=self.recipe,
+            ingredient=Ingredient.objects.create(
+                name='соль', measurement_unit='г'
+            ),
+            amount=7
+        )
+        self.assertListsRebuilt()
+        RecipeIngredient.objects.filter(
+            recipe=self.recipe, ingredient__in=self.ingredients[1:5]
+        ).delete()
+        self.assertListsRebuilt()
+
+    def test_recipe_deleted(self):
+        other = Recipe.objects.create(
+            author=self.author,
+            name='Другой рецепт',
+            image=RECIPE_IMAGE,
+            text='Описание',
+            cooking_time=10,
+        )
+        RecipeIngredient.objects.create(
+            recipe=other, ingredient=self.ingredients[0], amount=3
+        )
+        self.client.force_authenticate(self.buyers[0])
+        self.client.post(reverse('recipes-shopping-cart', args=(other.pk,)))
+        self.recipe.delete()
+        self.assertListsRebuilt()
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.buyers[0]).amount, 3
+        )
+        self.assertFalse(shopping_list.suspended_recipes())
+
+    def test_replace_ingredients(self):
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'новый {number}', measurement_unit='г')
+            for number in range(10)
+        ])
+        extra = list(Ingredient.objects.filter(name__startswith='новый'))
+        ingredients = [
+            {'id': ingredient.pk, 'amount': 5}
+            for ingredient in self.ingredients[:20] + extra
+        ]
+        response = self.patch_ingredients(ingredients)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListsRebuilt()
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, QUERY_BUDGET_STRICT=True)
+class PermissionQueryTests(APITransactionTestCase):
+    """Проверка прав не добавляет запросов к базе."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.author = create_user('author')
+        self.other = create_user('other')
+        self.admin = create_user('admin')
+        self.admin.is_staff = True
+        self.admin.save()
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            image=RECIPE_IMAGE,
+            text='Описание',
+            cooking_time=10,
+        )
+        self.recipe.tags.add(self.tag)
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=10
+        )
+        self.url = reverse('recipes-detail', args=(self.recipe.pk,))
+
+    def test_patch(self):
+        for user, queries, expected in (
+            (self.author, 16, status.HTTP_200_OK),
+            (self.other, 1, status.HTTP_403_FORBIDDEN),
+        ):
+            with self.subTest(user=user.username):
+                self.client.force_authenticate(user)
+                with self.assertNumQueries(queries):
+                    response = self.client.patch(self.url, {'name': 'Новый'})
+                self.assertEqual(response.status_code, expected)
+
+    def test_delete(self):
+        for user, queries, expected in (
+            (self.other, 1, status.HTTP_403_FORBIDDEN),
+            (self.author, 20, status.HTTP_204_NO_CONTENT),
+        ):
+            with self.subTest(user=user.username):
+                self.client.force_authenticate(user)
+                with self.assertNumQueries(queries):
+                    response = self.client.delete(self.url)
+                self.assertEqual(response.status_code, expected)
+
+    def test_catalogue_reads(self):
+        urls = (
+            (reverse('tags-list'), 0),
+            (reverse('tags-detail', args=(self.tag.pk,)), 1),
+            (reverse('ingredients-list'), 0),
+            (reverse('ingredients-detail', args=(self.ingredient.pk,)), 1),
+        )
+        for url, _ in urls:
+            self.client.get(url)
+        for user in (self.admin, self.other):
+            self.client.force_authenticate(user)
+            for url, queries in urls:
+                with self.subTest(user=user.username, url=url):
+                    with self.assertNumQueries(queries):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_catalogue_writes(self):
+        for user, expected in (
+            (self.admin, status.HTTP_405_METHOD_NOT_ALLOWED),
+            (self.other, status.HTTP_403_FORBIDDEN),
+        ):
+            self.client.force_authenticate(user)
+            with self.subTest(user=user.username):
+                with self.assertNumQueries(0):
+                    response = self.client.post(
+                        reverse('ingredients-list'),
+                        {'name': 'соль', 'measurement_unit': 'г'}
+                    )
+                self.assertEqual(response.status_code, expected)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, QUERY_BUDGET_STRICT=True)
+class RecipeListQueryTests(APITransactionTestCase):
+    """Страница рецептов стоит одинаковое число запросов при любом размере."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        authors = [create_user(f'author{number}') for number in range(3)]
+        self.user = create_user('reader')
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(5)
+        ])
+        ingredients = list(Ingredient.objects.all())
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f'Рецепт {number}',
+                image=RECIPE_IMAGE,
+                text='Описание',
+                cooking_time=10,
+            )
+            recipe.tags.set(tags[:number % len(tags) + 1])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients[:number % 4 + 2]
+            ])
+            if number % 2:
+                self.client.force_authenticate(self.user)
+                self.client.post(
+                    reverse('recipes-favorite', args=(recipe.pk,))
+                )
+        self.client.force_authenticate(self.user)
+        self.client.post(
+            reverse('users-subscribe', args=(authors[0].pk,))
+        )
+        self.client.force_authenticate(None)
+
+    def assertPageQueries(self, queries):
+        for limit in (3, 12):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get(
+                        reverse('recipes-list'), {'limit': limit}
+                    )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.data['results']), limit)
+        return response.data['results']
+
+    def test_anonymous(self):
+        results = self.assertPageQueries(4)
+        self.assertFalse(any(recipe['is_favorited'] for recipe in results))
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.user)
+        results = self.assertPageQueries(4)
+        self.assertEqual(
+            sum(recipe['is_favorited'] for recipe in results), 6
+        )
+        self.assertEqual(
+            sum(recipe['author']['is_subscribed'] for recipe in results), 4
+        )
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class ConditionalRequestTests(APITransactionTestCase):
+    """Ответ 304 без устаревших флагов пользователя."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.reader = create_user('reader')
+        self.recipe = Recipe.objects.create(
+            author=create_user('author'),
+            name='Рецепт',
+            image=RECIPE_IMAGE,
+            text='Описание',
+            cooking_time=10,
+        )
+        self.list_url = reverse('recipes-list')
+        self.detail_url = reverse('recipes-detail', args=(self.recipe.pk,))
+
+    def favorite(self):
+        response = self.client.post(
+            reverse('recipes-favorite', args=(self.recipe.pk,))
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_anonymous_list(self):
+        etag = self.client.get(self.list_url)['ETag']
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.recipe.name = 'Новое'
+        self.recipe.save()
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_follows_user_flags(self):
+        self.client.force_authenticate(self.reader)
+        etag = self.client.get(self.list_url)['ETag']
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.favorite()
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+
+    def test_list_validator_without_aggregate(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.list_url)
+        self.assertFalse(any(
+            'MAX(' in query['sql'].upper() for query in queries
+        ))
+
+    def test_detail_user_state_needs_shared_cache(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', response)
+        with tempfile.TemporaryDirectory() as directory, file_cache(
+            directory
+        ):
+            etag = self.client.get(self.detail_url)['ETag']
+            response = self.client.get(
+                self.detail_url, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_304_NOT_MODIFIED
+            )
+            self.favorite()
+            response = self.client.get(
+                self.detail_url, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_favorited'])
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class RecipeCacheTests(APITransactionTestCase):
+    """Кэш ответов сбрасывается только для затронутых страниц."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.breakfast = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        self.lunch = Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch'
+        )
+        self.author = create_user('author')
+        self.other = create_user('other')
+        self.pancakes = self.create_recipe(
+            self.author, 'Блины', self.breakfast
+        )
+        self.soup = self.create_recipe(self.other, 'Суп', self.lunch)
+
+    @staticmethod
+    def create_recipe(author, name, tag):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=name,
+            image=RECIPE_IMAGE,
+            text='Описание',
+            cooking_time=10,
+        )
+        recipe.tags.add(tag)
+        return recipe
+
+    def fetch(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def assertCache(self, expected, url, **params):
+        self.assertEqual(self.fetch(url, **params)['X-Cache'], expected)
+
+    def test_hit_after_miss(self):
+        list_url = reverse('recipes-list')
+        detail_url = reverse('recipes-detail', args=(self.soup.pk,))
+        for url in (list_url, detail_url):
+            self.assertCache('MISS', url)
+            self.assertCache('HIT', url)
+        # Порядок параметров не влияет на ключ.
+        self.assertCache('MISS', list_url, tags='breakfast', page=1)
+        self.assertCache('HIT', list_url, page=1, tags='breakfast')
+        stats = get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+
+    def test_authenticated_not_cached(self):
+        self.client.force_authenticate(self.author)
+        self.assertNotIn('X-Cache', self.fetch(reverse('recipes-list')))
+
+    def test_write_drops_affected_pages(self):
+        url = reverse('recipes-list')
+        pages = (
+            {'tags': 'breakfast'}, {'tags': 'lunch'},
+            {'author': self.author.pk}, {'author': self.other.pk},
+        )
+        for params in pages:
+            self.fetch(url, **params)
+        self.pancakes.name = 'Оладьи'
+        self.pancakes.save()
+        response = self.fetch(url, tags='breakfast')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Оладьи')
+        self.assertCache('MISS', url, author=self.author.pk)
+        self.assertCache('HIT', url, tags='lunch')
+        self.assertCache('HIT', url, author=self.other.pk)
+
+    def test_retag_drops_old_and_new_tag(self):
+        url = reverse('recipes-list')
+        for retag in (
+            lambda: self.pancakes.tags.set([self.lunch]),
+            lambda: (
+                self.pancakes.tags.clear(),
+                self.pancakes.tags.add(self.breakfast)
+            ),
+        ):
+            with self.subTest(retag=retag):
+                self.fetch(url, tags='breakfast')
+                self.fetch(url, tags='lunch')
+                # Как в запросе: сброс после фиксации транзакции.
+                with transaction.atomic():
+                    retag()
+                for slug in ('breakfast', 'lunch'):
+                    self.assertCache('MISS', url, tags=slug)
+        self.assertEqual(
+            [
+                recipe['name'] for recipe
+                in self.fetch(url, tags='breakfast').data['results']
+            ],
+            ['Блины']
+        )
+
+    def test_author_change_updates_fragment(self):
+        self.client.force_authenticate(self.other)
+        url = reverse('recipes-detail', args=(self.pancakes.pk,))
+        self.fetch(url)
+        self.author.first_name = 'Пётр'
+        self.author.save()
+        self.assertEqual(self.fetch(url).data['author']['first_name'], 'Пётр')
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class ImageCollectionTests(APITransactionTestCase):
+    """Общие файлы изображений остаются, файлы без ссылок удаляются."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        self.author = create_user('author')
+        self.first = self.create_recipe('Первый', seeding.PNG)
+        self.second = self.create_recipe('Второй', seeding.PNG)
+        self.name = self.first.image.name
+        self.storage = self.first.image.storage
+
+    def create_recipe(self, name, content):
+        recipe = Recipe(
+            author=self.author, name=name, text='Описание', cooking_time=10
+        )
+        recipe.image.save('photo.png', ContentFile(content))
+        return recipe
+
+    def collect(self, grace_hours=0):
+        with mock.patch('builtins.print'):
+            call_command('collect_images', grace_hours=grace_hours)
+
+    def files(self, name):
+        return [name] + [
+            images.variant_name(name, variant) for variant in images.VARIANTS
+        ]
+
+    def assertFilesExist(self, name, exist=True):
+        for path in self.files(name):
+            with self.subTest(path=path):
+                self.assertEqual(self.storage.exists(path), exist)
+
+    def test_identical_uploads_share_file(self):
+        self.assertEqual(self.second.image.name, self.name)
+        self.assertEqual(StoredImage.objects.filter(name=self.name).count(), 1)
+        self.assertFilesExist(self.name)
+
+    def test_shared_file_kept(self):
+        self.first.delete()
+        self.collect()
+        self.assertFilesExist(self.name)
+        self.assertIsNone(
+            StoredImage.objects.get(name=self.name).released_at
+        )
+
+    def test_orphan_deleted_with_variants(self):
+        self.first.delete()
+        self.second.delete()
+        self.collect(grace_hours=1)
+        self.assertFilesExist(self.name)
+        self.collect()
+        self.assertFilesExist(self.name, exist=False)
+        self.assertFalse(StoredImage.objects.filter(name=self.name).exists())
+
+    def test_replaced_image_collected(self):
+        buffer = BytesIO()
+        Image.new('RGB', (2, 2), 'red').save(buffer, 'PNG')
+        for recipe in (self.first, self.second):
+            recipe.image.save('photo.png', ContentFile(buffer.getvalue()))
+        self.collect()
+        self.assertFilesExist(self.name, exist=False)
+        self.assertFilesExist(self.first.image.name)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class RecipeSearchTests(APITransactionTestCase):
+    """Полнотекстовый поиск и поиск по началу названия."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.author = create_user('author')
+        self.pie = self.create_recipe('Ёжиковый ПИРОГ', 'Испечь.')
+        self.salad = self.create_recipe('Салат', 'Подать с пирогом.')
+        RecipeIngredient.objects.create(
+            recipe=self.salad,
+            ingredient=Ingredient.objects.create(
+                name='Ежевика', measurement_unit='г'
+            ),
+            amount=100
+        )
+
+    def create_recipe(self, name, text):
+        return Recipe.objects.create(
+            author=self.author,
+            name=name,
+            image=RECIPE_IMAGE,
+            text=text,
+            cooking_time=10,
+        )
+
+    def names(self, **params):
+        response = self.client.get(reverse('recipes-list'), params)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_search_ranks_name_above_text(self):
+        self.assertEqual(
+            self.names(search='пирог'), ['Ёжиковый ПИРОГ', 'Салат']
+        )
+
+    def test_search_folds_case_and_yo(self):
+        self.assertEqual(self.names(search='ЁЖЕВ'), ['Салат'])
+        self.assertEqual(self.names(search='ежиковый'), ['Ёжиковый ПИРОГ'])
+
+    def test_search_follows_edits(self):
+        self.pie.name = 'Ватрушка'
+        self.pie.save()
+        self.assertEqual(self.names(search='ватруш'), ['Ватрушка'])
+        self.assertEqual(self.names(search='пирог'), ['Салат'])
+
+    def test_rebuild_keeps_results(self):
+        with mock.patch('builtins.print'):
+            call_command('rebuild_search_index', batch_size=1)
+        self.assertEqual(self.names(search='ежевика'), ['Салат'])
+
+    def test_name_prefix(self):
+        self.assertEqual(self.names(name='ЕЖИК'), ['Ёжиковый ПИРОГ'])
+        self.assertEqual(self.names(name='сал'), ['Салат'])
+        self.assertEqual(self.names(name='пирог'), [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2', 'replica3'])
+class ReplicaMiddlewareTests(SimpleTestCase):
+    """Отметка «читать своё» видна всем процессам или реплики выключены."""
+
+    def test_process_cache_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaMiddleware(lambda request: None)
+
+    def test_shared_cache(self):
+        with tempfile.TemporaryDirectory() as directory, file_cache(
+            directory
+        ):
+            ReplicaMiddleware(lambda request: None)
+
+    def test_one_replica_per_request(self):
+        router = ReplicaRouter()
+
+        def get_response(request):
+            return {router.db_for_read(Recipe) for _ in range(20)}
+
+        with tempfile.TemporaryDirectory() as directory, file_cache(
+            directory
+        ):
+            middleware = ReplicaMiddleware(get_response)
+            for _ in range(5):
+                aliases = middleware(RequestFactory().get('/api/recipes/'))
+                self.assertEqual(len(aliases), 1)
+                self.assertNotIn('default', aliases)
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(APITransactionTestCase):
+    """Счётчик запросов и бюджеты действий.
+
+    Тесты с бюджетами транзакционные: в TestCase транзакция не
+    фиксируется, и работа из on_commit (сброс кэша, поисковый индекс,
+    копии изображений) не попала бы в счёт запросов.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(create_user('user'))
+
+    def test_budget_exceeded(self):
+        with mock.patch.dict(RecipeViewSet.query_budgets, {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('recipes-list'))
+
+    def test_server_timing(self):
+        tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('tags-detail', args=(tag.pk,))
+            )
+        self.assertIn(
+            f'desc="{len(queries)} queries"', response['Server-Timing']
+        )
+        self.assertIn('serializer;dur=', response['Server-Timing'])
+        self.assertGreater(response.wsgi_request.metrics.serializer_time, 0)
+
+    @skipUnless(connection.vendor == 'sqlite', 'PRAGMA есть только в SQLite')
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234})
+    def test_connection_setup_not_counted(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            configure_sqlite(None, connection)
+        self.assertEqual(metrics.queries, 0)
+        self.assertEqual(
+            connection.connection.execute('PRAGMA busy_timeout').fetchone(),
+            (1234,)
+        )
+
+    def test_streaming_response_counted_until_closed(self):
+        url = reverse('recipes-download-shopping-cart')
+        response = self.client.get(url)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(response.wsgi_request.metrics.queries, 0)
+        b''.join(response.streaming_content)
+        self.assertEqual(response.wsgi_request.metrics.queries, 1)
+        budgets = {'download_shopping_cart': 0}
+        with mock.patch.dict(RecipeViewSet.query_budgets, budgets):
+            response = self.client.get(url)
+            with self.assertRaises(QueryBudgetExceeded):
+                b''.join(response.streaming_content)
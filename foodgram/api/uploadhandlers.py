@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Потоковая запись загружаемого файла во временный файл на диске.
+
+    Данные сверх IMAGE_UPLOAD_MAX_SIZE не записываются, но учитываются в
+    размере файла, поэтому поле изображения отклоняет его, не открывая.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        limit = settings.IMAGE_UPLOAD_MAX_SIZE
+        if start < limit:
+            super().receive_data_chunk(raw_data[:limit - start], start)
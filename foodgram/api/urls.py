@@ -3,7 +3,8 @@ from django.urls import include
 from rest_framework.routers import DefaultRouter
 
 from api.views import (
-    RecipeViewSet, CustomUserViewSet, TagViewSet, IngredientViewSet
+    RecipeViewSet, CustomUserViewSet, TagViewSet, IngredientViewSet,
+    CatalogueView, CatalogueVersionsView, TokenCacheStatsView
 )
 
 
@@ -15,7 +16,22 @@ router_v1.register(r'users', CustomUserViewSet, basename='users')
 
 
 urlpatterns = [
+    url(
+        r'^catalogue/$',
+        CatalogueVersionsView.as_view(),
+        name='catalogue-versions'
+    ),
+    url(
+        r'^catalogue/(?P<name>[a-z]+)/(?P<version>[0-9a-f]+)/$',
+        CatalogueView.as_view(),
+        name='catalogue'
+    ),
     url(r'', include(router_v1.urls)),
     url('', include('djoser.urls')),
+    url(
+        r'^auth/token-cache/$',
+        TokenCacheStatsView.as_view(),
+        name='token-cache-stats'
+    ),
     url(r'^auth/', include('djoser.urls.authtoken')),
 ]
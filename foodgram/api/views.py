@@ -1,28 +1,49 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import (
+    BooleanField, Exists, F, OuterRef, Prefetch, Value
+)
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.permissions import (
-    IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
+    IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly, IsAdminUser
 )
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import CustomPagination
+from api import cache
+from api.authentication import token_cache
+from api.catalogue import catalogues
+from api.conditional import (
+    conditional_response, content_conditional_response
+)
+from api.db import retry_on_locked
+from api.filters import RecipeFilter
+from api.ingredient_index import ingredient_index
+from api.pagination import CustomPagination, RecipePagination
 from api.permissions import IsAdminOrReadOnly, IsOwnerOrReadOnly
+from api.renderers import (
+    ShoppingListCSVRenderer, ShoppingListJSONRenderer, ShoppingListTextRenderer
+)
 from api.serializers import (
     RecipeListSerializer, RecipeCreateUpdateSerializer, TagSerializer,
     FavoriteRecipeSerializer, IngredientSerializer,
-    CustomUserSerializer, SubscribeSerializer, SubscriptionSerializer
+    CustomUserSerializer, SubscribeSerializer, SubscriptionSerializer,
+    ShoppingListItemSerializer, get_recipes_limit
 )
 from users.models import User, Subscribe
 from recipes.models import (
-    Recipe, Tag, RecipeIngredient, Ingredient, ShoppingCart, FavoriteRecipe
+    Recipe, Tag, Ingredient, ShoppingCart, FavoriteRecipe, ShoppingListItem
 )
 
 
@@ -33,6 +54,26 @@ class CustomUserViewSet(UserViewSet):
     serializer_class = CustomUserSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = CustomPagination
+    query_budgets = {
+        'list': 3,
+        'retrieve': 2,
+        'me': 2,
+        'subscriptions': 4,
+        'subscribe': 8,
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            is_subscribed = Value(False, output_field=BooleanField())
+        else:
+            is_subscribed = Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('pk')
+            ))
+        return queryset.annotate(is_subscribed=is_subscribed)
 
     @action(
         detail=True,
@@ -41,6 +82,7 @@ class CustomUserViewSet(UserViewSet):
         url_path='subscribe',
         url_name='subscribe',
     )
+    @retry_on_locked
     def subscribe(self, request, id):
         """Метод для создания подписки."""
 
@@ -51,6 +93,7 @@ class CustomUserViewSet(UserViewSet):
             author=author.id
         )
         if request.method == 'POST':
+            get_recipes_limit(request)
             if user == author:
                 return Response(
                     'Вы пытаетесь подписаться на себя!!',
@@ -105,7 +148,16 @@ class CustomUserViewSet(UserViewSet):
     def subscriptions(self, request):
         """Метод для просмотра подписок."""
 
-        queryset = User.objects.filter(follow__user=self.request.user)
+        recipes_limit = get_recipes_limit(request)
+        queryset = User.objects.filter(
+            follow__user=self.request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).prefetch_related(Prefetch(
+            'recipes',
+            queryset=Recipe.objects.latest_per_author(recipes_limit),
+            to_attr='latest_recipes'
+        ))
         page = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(
             page,
@@ -121,13 +173,81 @@ class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.all()
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = (IsOwnerOrReadOnly,)
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+    query_budgets = {
+        'list': 8,
+        'retrieve': 5,
+        'create': 35,
+        'partial_update': 40,
+        'destroy': 40,
+        'favorite': 8,
+        'shopping_cart': 12,
+        'download_shopping_cart': 2,
+        'shopping_cart_summary': 3,
+    }
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_list(self.request.user)
+        return Recipe.objects.with_user_flags(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        """Страница из кэша или из базы, 304 по её содержимому.
+
+        Валидатор строится по уже полученной странице, а не агрегатом по
+        всей выборке: стоимость страницы не зависит от её глубины.
+        """
+
+        return content_conditional_response(
+            request,
+            cache.cached_response(
+                request,
+                cache.list_dependencies(request.query_params),
+                lambda: super(RecipeViewSet, self).list(
+                    request, *args, **kwargs
+                )
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+
+        def get_response():
+            return cache.cached_response(
+                request,
+                cache.detail_dependencies(pk),
+                lambda: super(RecipeViewSet, self).retrieve(
+                    request, *args, **kwargs
+                )
+            )
+
+        try:
+            updated_at = Recipe.objects.filter(
+                pk=pk
+            ).values_list('updated_at', flat=True).first()
+        except ValueError:
+            updated_at = None
+        if updated_at is None:
+            return get_response()
+        return conditional_response(
+            request, (updated_at,), get_response, last_modified=updated_at
+        )
+
+    @retry_on_locked
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @retry_on_locked
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @retry_on_locked
+    def perform_destroy(self, instance):
+        instance.delete()
+
     def get_serializer_class(self):
         """Метод для выбора сериализатора."""
         if self.action in ('create', 'update', 'partial_update'):
@@ -141,6 +261,7 @@ class RecipeViewSet(ModelViewSet):
         url_path='favorite',
         url_name='favorite',
     )
+    @retry_on_locked
     def favorite(self, request, pk):
         """Метод для добавления в избранное."""
 
@@ -186,6 +307,7 @@ class RecipeViewSet(ModelViewSet):
         detail=True,
         permission_classes=(IsAuthenticated,),
     )
+    @retry_on_locked
     def shopping_cart(self, request, pk):
         """Метод для добавления в список покупок."""
 
@@ -222,53 +344,192 @@ class RecipeViewSet(ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-    @staticmethod
-    def ingredients_to_txt(ingredients):
-        """Метод для объединения ингредиентов в список для загрузки."""
-
-        shopping_list = ''
-        for ingredient in ingredients:
-            shopping_list += (
-                f"{ingredient['ingredient__name']}  - "
-                f"{ingredient['sum']}"
-                f"({ingredient['ingredient__measurement_unit']})\n"
-            )
-        return shopping_list
-
     @action(
         detail=False,
         methods=('get',),
         permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            ShoppingListTextRenderer,
+            ShoppingListCSVRenderer,
+            ShoppingListJSONRenderer,
+        ),
     )
     def download_shopping_cart(self, request):
-        """Метод для загрузки списка ингредиентов."""
+        """Метод для загрузки списка ингредиентов.
 
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shopping_recipe__user=request.user
+        Формат выбирается параметром format (txt, csv или json), список
+        агрегируется и отдаётся потоком без сборки целиком в памяти.
+        """
+
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
         ).values(
+            'ingredient_id',
             'ingredient__name',
             'ingredient__measurement_unit'
-        ).annotate(sum=Sum('amount'))
-        shopping_list = self.ingredients_to_txt(ingredients)
-        return HttpResponse(shopping_list, content_type='text/plain')
+        ).annotate(
+            sum=F('amount')
+        ).order_by('ingredient__search_name', 'ingredient_id')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+    )
+    def shopping_cart_summary(self, request):
+        """Метод для просмотра суммарного списка покупок."""
+
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by(
+            'ingredient__search_name', 'ingredient_id'
+        )
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
+
+
+class CatalogueMixin:
+    """Справочник целиком отдаётся из снимка в памяти процесса.
+
+    Ответ 304 выдаётся по версии снимка, пока справочник не менялся.
+    """
+
+    catalogue = None
+
+    def get_snapshot(self):
+        return catalogues[self.catalogue].get_snapshot()
+
+    def list(self, request, *args, **kwargs):
+        snapshot = self.get_snapshot()
+        return conditional_response(
+            request,
+            (snapshot.version,),
+            lambda: Response(snapshot.data),
+            per_user=False
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            (self.get_snapshot().version,),
+            lambda: super(CatalogueMixin, self).retrieve(
+                request, *args, **kwargs
+            ),
+            per_user=False
+        )
 
 
-class TagViewSet(ModelViewSet):
+class TagViewSet(CatalogueMixin, ModelViewSet):
     """Вьюсет для тегов."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_class = (AllowAny,)
+    permission_classes = (AllowAny,)
     http_method_names = ['get']
+    catalogue = 'tags'
+    query_budgets = {'list': 2, 'retrieve': 2}
 
 
-class IngredientViewSet(ModelViewSet):
+class IngredientViewSet(CatalogueMixin, ModelViewSet):
     """Вьюсет для ингредиентов."""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    permission_class = (IsAdminOrReadOnly)
-    search_fields = ('^name')
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
+    permission_classes = (IsAdminOrReadOnly,)
     http_method_names = ['get']
+    catalogue = 'ingredients'
+    query_budgets = {'list': 2, 'retrieve': 2}
+
+    def list(self, request, *args, **kwargs):
+        """Поиск по названию обслуживается индексом в памяти.
+
+        Индекс сравнивает те же нормализованные названия, что и
+        search_prefix, поэтому отдельный фильтр по базе не нужен.
+        """
+
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        return conditional_response(
+            request,
+            (self.get_snapshot().version,),
+            lambda: Response(ingredient_index.search(name, self.get_limit())),
+            per_user=False
+        )
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            return settings.INGREDIENT_SEARCH_LIMIT
+        return min(max(limit, 1), settings.INGREDIENT_SEARCH_LIMIT)
+
+
+class CatalogueVersionsView(APIView):
+    """Текущие версии справочников и адреса их неизменяемых копий."""
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        data = {}
+        for name, catalogue in catalogues.items():
+            version = catalogue.get_snapshot().version
+            data[name] = {
+                'version': version,
+                'url': request.build_absolute_uri(
+                    reverse('catalogue', args=(name, version))
+                ),
+            }
+        response = Response(data)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class CatalogueView(APIView):
+    """Справочник заданной версии, который можно кэшировать навсегда.
+
+    Тело отдаётся готовым, при поддержке клиентом — сжатым gzip. Запрос
+    устаревшей версии перенаправляется на текущую.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request, name, version):
+        catalogue = catalogues.get(name)
+        if catalogue is None:
+            raise NotFound('Справочник не найден.')
+        snapshot = catalogue.get_snapshot()
+        if version != snapshot.version:
+            return redirect('catalogue', name, snapshot.version)
+        response = HttpResponse(content_type='application/json')
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response.content = snapshot.compressed
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response.content = snapshot.body
+        response['ETag'] = quote_etag(snapshot.version)
+        response['Cache-Control'] = (
+            f'public, max-age={settings.CATALOGUE_MAX_AGE}, immutable'
+        )
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class TokenCacheStatsView(APIView):
+    """Статистика кэша токенов текущего процесса."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(token_cache.get_stats())
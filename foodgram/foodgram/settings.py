@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -38,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.db.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -68,9 +70,86 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Реплики для чтения: имена баз через запятую, с тем же движком.
+for number, name in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['api.db.ReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = 10
+DATABASE_HEALTH_CHECK_INTERVAL = 30
+
+# Профиль SQLite для работы под нагрузкой, отключается SQLITE_TUNING=0.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+} if os.getenv('SQLITE_TUNING', '1') == '1' else {}
+SQLITE_LOCKED_RETRIES = 3
+SQLITE_LOCKED_BACKOFF = 0.05
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# Кэш в памяти процесса годится для одного процесса; для нескольких
+# процессов и реплик задаётся общий, например CACHE_BACKEND=
+# django.core.cache.backends.memcached.PyMemcacheCache.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+RECIPE_CACHE_ALIAS = 'default'
+RECIPE_CACHE_TIMEOUT = 60 * 5
+RECIPE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+CATALOGUE_MAX_AGE = 60 * 60 * 24 * 365
+# Без общего кэша снимки справочников перестраиваются не реже этого.
+CATALOGUE_REFRESH_INTERVAL = 60
+
+# Превышение бюджета запросов действия — ошибка при QUERY_BUDGET_STRICT=1,
+# иначе предупреждение в журнале. Тесты включают его через override_settings.
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.metrics': {
+            'handlers': ['console'],
+            'level': os.getenv('METRICS_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60 * 5
+# С кэшем в памяти процесса запись сверяется с базой не чаще этого.
+TOKEN_CACHE_REVALIDATE = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -94,7 +173,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
@@ -119,6 +198,17 @@ USE_TZ = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/app/media/'
 
+IMAGE_UPLOAD_MAX_SIZE = 5 * 1024 * 1024
+IMAGE_UPLOAD_MAX_DIMENSION = 4096
+IMAGE_VARIANT_WORKERS = 2
+
+FILE_UPLOAD_HANDLERS = [
+    'api.uploadhandlers.LimitedTemporaryFileUploadHandler',
+]
+
+# Изображение в base64 на треть длиннее исходного файла.
+DATA_UPLOAD_MAX_MEMORY_SIZE = IMAGE_UPLOAD_MAX_SIZE * 4 // 3 + 1024 * 1024
+
 STATIC_URL = '/static/backend/'
 STATIC_ROOT = '/app/static_backend/'
 
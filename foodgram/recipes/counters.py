@@ -0,0 +1,43 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+from users.models import User
+
+
+COUNTERS = (
+    (User, 'recipes_count', Recipe, 'author'),
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+)
+
+
+def actual_count(model, field):
+    """Подзапрос с реальным количеством связанных строк."""
+
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0
+    )
+
+
+def increment(queryset, counter):
+    """Атомарное увеличение счётчика без чтения строки."""
+
+    queryset.update(**{counter: F(counter) + 1})
+
+
+def recount(queryset, counter, model, field):
+    """Счётчик по реальному числу связанных строк одним UPDATE.
+
+    При удалении счётчик не уменьшается, а пересчитывается: накопившееся
+    расхождение исправляется, а не скрывается ограничением снизу.
+    """
+
+    queryset.update(**{counter: actual_count(model, field)})
@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+from django.db import models
+from django.db.models.fields.files import ImageFieldFile
+
+
+def file_digest(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedFieldFile(ImageFieldFile):
+    """Файл, сохраняемый под хэшем своего содержимого.
+
+    Одинаковые загрузки получают одно имя, и повторно файл не пишется.
+    """
+
+    def save(self, name, content, save=True):
+        digest = file_digest(content)
+        extension = os.path.splitext(name)[1].lower()
+        relative_name = f'{digest[:2]}/{digest}{extension}'
+        name = self.field.generate_filename(self.instance, relative_name)
+        if not self.storage.exists(name):
+            super().save(relative_name, content, save)
+            return
+        self.name = name
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+    save.alters_data = True
+
+
+class ContentAddressedImageField(models.ImageField):
+    attr_class = ContentAddressedFieldFile
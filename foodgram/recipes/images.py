@@ -0,0 +1,201 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe, StoredImage
+
+
+# Имя копии: (наибольшая сторона, формат Pillow, окончание имени файла).
+VARIANTS = {
+    'card': (480, 'JPEG', 'card.jpg'),
+    'detail': (1200, 'JPEG', 'detail.jpg'),
+    'webp': (480, 'WEBP', 'card.webp'),
+}
+QUALITY = 82
+
+logger = logging.getLogger(__name__)
+
+executor_lock = threading.Lock()
+executor = None
+
+
+def variant_name(name, variant):
+    """Копия хранится рядом с оригиналом: photo.jpg -> photo.card.jpg."""
+
+    return f'{os.path.splitext(name)[0]}.{VARIANTS[variant][2]}'
+
+
+def variant_names(recipe):
+    """Имена файлов копий или оригинала, пока копии не готовы."""
+
+    name = recipe.image.name
+    if not name or recipe.variants_image != name:
+        return {variant: name for variant in VARIANTS}
+    return {variant: variant_name(name, variant) for variant in VARIANTS}
+
+
+def is_variant(name):
+    return any(
+        name.endswith(f'.{suffix}') for _, _, suffix in VARIANTS.values()
+    )
+
+
+def render_variant(image, variant):
+    size, format, _ = VARIANTS[variant]
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format, quality=QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def create_variants(storage, name):
+    with storage.open(name) as file:
+        image = Image.open(file)
+        # JPEG декодируется сразу в уменьшенном масштабе.
+        image.draft('RGB', (VARIANTS['detail'][0],) * 2)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    for variant in VARIANTS:
+        path = variant_name(name, variant)
+        if storage.exists(path):
+            storage.delete(path)
+        storage.save(path, ContentFile(render_variant(image, variant)))
+
+
+def generate(recipe_id, name, force=False):
+    """Создаёт копии изображения и отмечает рецепт готовым.
+
+    Если изображение рецепта успело смениться, копии старого не
+    отмечаются: для нового изображения поставлена своя задача.
+    """
+
+    recipe = Recipe.objects.filter(pk=recipe_id, image=name).first()
+    if recipe is None or (recipe.variants_image == name and not force):
+        return False
+    storage = recipe.image.storage
+    if force or not all(
+        storage.exists(variant_name(name, variant)) for variant in VARIANTS
+    ):
+        create_variants(storage, name)
+    recipe.variants_image = name
+    recipe.save(update_fields=('variants_image',))
+    return True
+
+
+def generate_in_worker(recipe_id, name, force=False):
+    try:
+        return generate(recipe_id, name, force)
+    except Exception:
+        logger.exception('Не удалось создать копии изображения %s', name)
+        return False
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                thread_name_prefix='image-variants'
+            )
+    return executor
+
+
+def drain():
+    """Дожидается копий, которые создаются в фоне."""
+
+    global executor
+    with executor_lock:
+        pending, executor = executor, None
+    if pending is not None:
+        pending.shutdown(wait=True)
+
+
+def schedule(recipe_id, name):
+    """Создание копий в фоне после фиксации транзакции.
+
+    При IMAGE_VARIANT_WORKERS = 0 копии создаются сразу.
+    """
+
+    def submit():
+        if settings.IMAGE_VARIANT_WORKERS:
+            get_executor().submit(generate_in_worker, recipe_id, name)
+        else:
+            generate(recipe_id, name)
+    transaction.on_commit(submit)
+
+
+def track(names):
+    """Отмечает файлы как используемые рецептами."""
+
+    names = {name for name in names if name}
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=name) for name in names], ignore_conflicts=True
+    )
+    StoredImage.objects.filter(
+        name__in=names, released_at__isnull=False
+    ).update(released_at=None)
+
+
+def release(names):
+    """Отмечает файлы, на которые могли перестать ссылаться рецепты."""
+
+    names = {name for name in names if name}
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=name) for name in names], ignore_conflicts=True
+    )
+    StoredImage.objects.filter(
+        name__in=names, released_at__isnull=True
+    ).update(released_at=timezone.now())
+
+
+def collect_garbage(storage, released_before, batch_size):
+    """Удаляет одну пачку файлов без ссылок вместе с их копиями.
+
+    Проверяются только отмеченные файлы, освобождённые раньше
+    released_before. Файлы, на которые снова ссылаются рецепты,
+    снимаются с отметки. Возвращает число проверенных и удалённых.
+    """
+
+    names = set(StoredImage.objects.filter(
+        released_at__lte=released_before
+    ).order_by('released_at').values_list('name', flat=True)[:batch_size])
+    referenced = set(Recipe.objects.filter(
+        image__in=names
+    ).values_list('image', flat=True))
+    StoredImage.objects.filter(name__in=referenced).update(released_at=None)
+    unreferenced = names - referenced
+    StoredImage.objects.filter(
+        name__in=unreferenced, released_at__lte=released_before
+    ).delete()
+    # Файл, снова взятый в работу после проверки, остаётся на месте.
+    unreferenced -= set(StoredImage.objects.filter(
+        name__in=unreferenced
+    ).values_list('name', flat=True))
+    for name in unreferenced:
+        storage.delete(name)
+        for variant in VARIANTS:
+            storage.delete(variant_name(name, variant))
+    return len(names), len(unreferenced)
+
+
+def find_files(storage, path):
+    """Все исходные изображения в каталоге хранилища, без копий."""
+
+    directories, files = storage.listdir(path)
+    for file in files:
+        name = f'{path}{file}'
+        if not is_variant(name):
+            yield name
+    for directory in directories:
+        yield from find_files(storage, f'{path}{directory}/')
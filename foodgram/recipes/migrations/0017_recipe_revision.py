@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_auto_20261018_0251'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Увеличивается при каждом изменении рецепта', verbose_name='Ревизия'),
+        ),
+    ]
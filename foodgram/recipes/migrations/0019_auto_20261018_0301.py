@@ -0,0 +1,33 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:01
+
+from django.db import migrations, models
+
+
+def fill_search_names(apps, schema_editor):
+    for model_name in ('Ingredient', 'Recipe'):
+        model = apps.get_model('recipes', model_name)
+        objs = list(model.objects.only('id', 'name'))
+        for obj in objs:
+            obj.search_name = obj.name.casefold().replace('ё', 'е')
+        model.objects.bulk_update(objs, ('search_name',), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_auto_20261018_0256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200, verbose_name='Название для поиска'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200, verbose_name='Название для поиска'),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+    ]
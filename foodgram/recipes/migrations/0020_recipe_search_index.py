@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from recipes.search import create_index, fill_index
+
+    connection = schema_editor.connection
+    create_index(connection)
+    fill_index(
+        connection,
+        apps.get_model('recipes', 'Recipe').objects.using(connection.alias),
+        apps.get_model('recipes', 'RecipeIngredient').objects.using(
+            connection.alias
+        )
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    from recipes.search import drop_index
+
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_auto_20261018_0301'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_auto_20261018_0305'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='variants_image',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Изображение, для которого созданы уменьшенные копии', max_length=100, verbose_name='Изображение с готовыми копиями'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:11
+
+from django.db import migrations, models
+import recipes.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_recipe_variants_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Имя файла')),
+                ('released_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Без ссылок с')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=recipes.fields.ContentAddressedImageField(db_index=True, help_text='Изображение рецепта', upload_to='recipes/media/', verbose_name='Изображение рецепта'),
+        ),
+    ]
@@ -1,11 +1,36 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import connections, models
+from django.utils import timezone
+
+from recipes.fields import ContentAddressedImageField
+from users.models import CounterFieldsMixin, Subscribe
 
 
 User = get_user_model()
 
 
+def normalize_search(value):
+    """Приведение строки к виду для поиска без учёта регистра и «ё»."""
+
+    return value.casefold().replace('ё', 'е')
+
+
+class SearchQuerySet(models.QuerySet):
+    """Поиск по нормализованному полю search_name."""
+
+    def search_prefix(self, value):
+        value = normalize_search(value)
+        if connections[self.db].vendor == 'sqlite':
+            # LIKE в SQLite не использует индекс с бинарным сравнением,
+            # а диапазон по байтам UTF-8 использует.
+            return self.filter(
+                search_name__gte=value,
+                search_name__lt=value + '\U0010ffff'
+            )
+        return self.filter(search_name__startswith=value)
+
+
 class Tag(models.Model):
     """Модель для тэга."""
 
@@ -60,6 +85,15 @@ class Ingredient(models.Model):
         max_length=200,
         verbose_name='Единицы измерения'
     )
+    search_name = models.CharField(
+        max_length=200,
+        verbose_name='Название для поиска',
+        default='',
+        db_index=True,
+        editable=False
+    )
+
+    objects = SearchQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Ингредиент'
@@ -68,8 +102,83 @@ class Ingredient(models.Model):
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search(self.name)
+        super().save(*args, **kwargs)
+
+
+class RecipeQuerySet(SearchQuerySet):
+    """Запросы для чтения рецептов."""
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного, корзины и подписки на автора."""
+
+        if user.is_anonymous:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            author_is_subscribed=models.Exists(Subscribe.objects.filter(
+                user=user, author=models.OuterRef('author')
+            )),
+        )
+
+    def for_list(self, user):
+        """Рецепты с автором и флагами пользователя для вывода списком.
+
+        Теги и ингредиенты подгружаются сериализатором только для тех
+        рецептов, которых нет в кэше.
+        """
+
+        return self.with_user_flags(user).select_related('author')
 
-class Recipe(models.Model):
+    @staticmethod
+    def detail_lookups():
+        """Связи, нужные для полного представления рецепта."""
+
+        return (
+            'tags',
+            models.Prefetch(
+                'recipe_ingredient',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def latest_per_author(self, limit):
+        """Не более limit последних рецептов каждого автора.
+
+        Ограничение задаётся коррелированным подзапросом, поэтому рецепты
+        всех авторов страницы выбираются одним запросом.
+        """
+
+        if limit is None:
+            return self
+        if limit == 0:
+            return self.none()
+        return self.filter(pk__in=models.Subquery(
+            Recipe.objects.filter(
+                author=models.OuterRef('author')
+            ).values('pk')[:limit]
+        ))
+
+    def touch(self):
+        """Увеличивает ревизию рецептов, сбрасывая их кэш."""
+
+        return self.update(
+            revision=models.F('revision') + 1, updated_at=timezone.now()
+        )
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -81,10 +190,26 @@ class Recipe(models.Model):
         max_length=200,
         help_text='Название рецепта'
     )
-    image = models.ImageField(
+    search_name = models.CharField(
+        max_length=200,
+        verbose_name='Название для поиска',
+        default='',
+        db_index=True,
+        editable=False
+    )
+    image = ContentAddressedImageField(
         verbose_name='Изображение рецепта',
         help_text='Изображение рецепта',
-        upload_to='recipes/media/'
+        upload_to='recipes/media/',
+        db_index=True
+    )
+    variants_image = models.CharField(
+        max_length=100,
+        verbose_name='Изображение с готовыми копиями',
+        help_text='Изображение, для которого созданы уменьшенные копии',
+        blank=True,
+        default='',
+        editable=False
     )
     text = models.TextField(
         verbose_name='Описание рецепта',
@@ -107,6 +232,11 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата создания'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения'
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         help_text='Время приготовления в минутах',
@@ -114,15 +244,54 @@ class Recipe(models.Model):
             MinValueValidator(1, message='Минимальное значение 1.')
         ]
     )
+    revision = models.PositiveIntegerField(
+        verbose_name='Ревизия',
+        help_text='Увеличивается при каждом изменении рецепта',
+        default=0,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'shopping_cart_count')
 
     class Meta:
-        ordering = ('-created_at', )
+        ordering = ('-created_at', '-id')
+        indexes = (
+            models.Index(
+                fields=('-created_at', '-id'),
+                name='recipe_created_at_id_idx',
+            ),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search(self.name)
+        adding = self._state.adding
+        if not adding:
+            self.revision = models.F('revision') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'revision', 'updated_at'
+                }
+        super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=('revision',))
+
 
 class TagRecipe(models.Model):
     tag = models.ForeignKey(
@@ -236,3 +405,61 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} {self.recipe}'
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'], name='unique_shoppinglistitem'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.amount}'
+
+
+class StoredImage(models.Model):
+    """Файл изображения в хранилище.
+
+    Файл, на который перестал ссылаться рецепт, отмечается временем
+    released_at и удаляется сборщиком, если ссылок так и не появилось.
+    """
+
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='Имя файла'
+    )
+    released_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name='Без ссылок с'
+    )
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,243 @@
+import re
+import threading
+
+from django.db import connections, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe, RecipeIngredient, normalize_search
+
+
+WORD_RE = re.compile(r'\w+')
+
+pending = threading.local()
+
+
+class SQLiteSearchBackend:
+    """Полнотекстовый индекс на виртуальной таблице FTS5."""
+
+    table = 'recipes_recipe_fts'
+    create_sql = (
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5('
+        "name, text, ingredients, tokenize='unicode61 remove_diacritics 2')",
+    )
+    drop_sql = (f'DROP TABLE IF EXISTS {table}',)
+    clear_sql = f'DELETE FROM {table}'
+    match_sql = f'SELECT rowid FROM {table} WHERE {table} MATCH %s'
+    rank_sql = (
+        f'SELECT -bm25({table}, 10.0, 1.0, 5.0) FROM {table} '
+        f'WHERE {table} MATCH %s AND rowid = "recipes_recipe"."id"'
+    )
+    delete_sql = f'DELETE FROM {table} WHERE rowid IN ({{}})'
+    # Рецепт может переиндексироваться одновременно из двух потоков,
+    # например после сохранения копий изображения: запись заменяет
+    # вставленную другим потоком между удалением и вставкой.
+    insert_sql = (
+        f'INSERT OR REPLACE INTO {table} (rowid, name, text, ingredients) '
+        'VALUES (%s, %s, %s, %s)'
+    )
+
+    @staticmethod
+    def make_query(value):
+        words = WORD_RE.findall(normalize_search(value))
+        return ' '.join(f'"{word}"*' for word in words)
+
+    @staticmethod
+    def make_row(pk, name, text, ingredients):
+        return (
+            pk,
+            normalize_search(name),
+            normalize_search(text),
+            normalize_search(ingredients),
+        )
+
+
+class PostgreSQLSearchBackend:
+    """Полнотекстовый индекс на tsvector с индексом GIN."""
+
+    table = 'recipes_recipe_search'
+    create_sql = (
+        f'CREATE TABLE IF NOT EXISTS {table} ('
+        'recipe_id bigint PRIMARY KEY '
+        'REFERENCES recipes_recipe (id) ON DELETE CASCADE, '
+        'document tsvector NOT NULL)',
+        f'CREATE INDEX IF NOT EXISTS {table}_document_idx '
+        f'ON {table} USING GIN (document)',
+    )
+    drop_sql = (f'DROP TABLE IF EXISTS {table}',)
+    clear_sql = f'DELETE FROM {table}'
+    match_sql = (
+        f'SELECT recipe_id FROM {table} '
+        "WHERE document @@ plainto_tsquery('russian', %s)"
+    )
+    rank_sql = (
+        "SELECT ts_rank(document, plainto_tsquery('russian', %s)) "
+        f'FROM {table} WHERE recipe_id = "recipes_recipe"."id"'
+    )
+    delete_sql = f'DELETE FROM {table} WHERE recipe_id IN ({{}})'
+    insert_sql = (
+        f'INSERT INTO {table} (recipe_id, document) VALUES (%s, '
+        "setweight(to_tsvector('russian', %s), 'A') || "
+        "setweight(to_tsvector('russian', %s), 'C') || "
+        "setweight(to_tsvector('russian', %s), 'B')) "
+        'ON CONFLICT (recipe_id) DO UPDATE SET document = EXCLUDED.document'
+    )
+
+    @staticmethod
+    def make_query(value):
+        return normalize_search(value)
+
+    @staticmethod
+    def make_row(pk, name, text, ingredients):
+        return (
+            pk,
+            normalize_search(name),
+            normalize_search(text),
+            normalize_search(ingredients),
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_backend(connection):
+    return BACKENDS.get(connection.vendor)
+
+
+def search_recipes(queryset, value):
+    """Рецепты, подходящие под запрос, по убыванию релевантности.
+
+    Без поддержки полнотекстового поиска в базе используется поиск по
+    подстроке в названии.
+    """
+
+    backend = get_backend(connections[queryset.db])
+    if backend is None:
+        return queryset.filter(search_name__contains=normalize_search(value))
+    query = backend.make_query(value)
+    if not query:
+        return queryset.none()
+    return queryset.filter(
+        pk__in=RawSQL(backend.match_sql, (query,))
+    ).annotate(
+        search_rank=RawSQL(
+            backend.rank_sql, (query,), output_field=FloatField()
+        )
+    ).order_by('-search_rank', *Recipe._meta.ordering)
+
+
+def index_rows(backend, recipes, recipe_ingredients):
+    """Строки индекса для рецептов и их ингредиентов."""
+
+    ingredients = {}
+    for recipe_id, name in recipe_ingredients.values_list(
+        'recipe_id', 'ingredient__name'
+    ):
+        ingredients.setdefault(recipe_id, []).append(name)
+    return [
+        backend.make_row(pk, name, text, ' '.join(ingredients.get(pk, ())))
+        for pk, name, text in recipes.values_list('pk', 'name', 'text')
+    ]
+
+
+def update_index(recipe_ids, using='default'):
+    """Пересчитывает записи индекса для рецептов."""
+
+    connection = connections[using]
+    backend = get_backend(connection)
+    recipe_ids = list(recipe_ids)
+    if backend is None or not recipe_ids:
+        return
+    rows = index_rows(
+        backend,
+        Recipe.objects.using(using).filter(pk__in=recipe_ids),
+        RecipeIngredient.objects.using(using).filter(
+            recipe_id__in=recipe_ids
+        )
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            backend.delete_sql.format(', '.join(['%s'] * len(recipe_ids))),
+            recipe_ids
+        )
+        cursor.executemany(backend.insert_sql, rows)
+
+
+def fill_index(connection, recipes, recipe_ingredients, batch_size=1000):
+    """Заполняет пустой индекс всеми рецептами пачками.
+
+    Наборы рецептов и ингредиентов передаются явно, чтобы миграция могла
+    использовать исторические модели.
+    """
+
+    backend = get_backend(connection)
+    if backend is None:
+        return 0
+    ids = recipes.order_by('pk').values_list('pk', flat=True)
+    total = 0
+    last_id = 0
+    while True:
+        batch = list(ids.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        rows = index_rows(
+            backend,
+            recipes.filter(pk__in=batch),
+            recipe_ingredients.filter(recipe_id__in=batch)
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(backend.insert_sql, rows)
+        total += len(batch)
+        last_id = batch[-1]
+    return total
+
+
+def schedule_update(recipe_ids):
+    """Обновление индекса после фиксации транзакции.
+
+    К этому моменту ингредиенты, добавленные через bulk_create, уже
+    записаны, а рецепт, изменённый несколько раз, обновляется один раз.
+    """
+
+    ids = getattr(pending, 'recipe_ids', None)
+    if ids is None:
+        ids = pending.recipe_ids = set()
+    ids.update(recipe_ids)
+    transaction.on_commit(flush_updates)
+
+
+def flush_updates():
+    recipe_ids = getattr(pending, 'recipe_ids', None)
+    if not recipe_ids:
+        return
+    pending.recipe_ids = None
+    update_index(recipe_ids)
+
+
+def create_index(connection):
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        for sql in backend.create_sql:
+            cursor.execute(sql)
+
+
+def drop_index(connection):
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        for sql in backend.drop_sql:
+            cursor.execute(sql)
+
+
+def clear_index(connection):
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(backend.clear_sql)
@@ -0,0 +1,203 @@
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+INSERT_MISSING_SQL = (
+    'INSERT INTO {item} (user_id, ingredient_id, amount) '
+    'SELECT cart.user_id, delta.ingredient_id, delta.amount '
+    'FROM {cart} cart CROSS JOIN ({deltas}) delta '
+    'WHERE cart.recipe_id = %s AND NOT EXISTS ('
+    'SELECT 1 FROM {item} item WHERE item.user_id = cart.user_id '
+    'AND item.ingredient_id = delta.ingredient_id)'
+)
+
+
+state = threading.local()
+
+
+def suspended_recipes():
+    """Рецепты, строки ингредиентов которых списки не отслеживают."""
+
+    if not hasattr(state, 'recipes'):
+        state.recipes = set()
+    return state.recipes
+
+
+@contextmanager
+def suspended(recipe_id):
+    """Сигналы строк ингредиентов рецепта не меняют списки покупок.
+
+    Для кода, который сам применяет изменения одним
+    apply_recipe_changes.
+    """
+
+    recipes = suspended_recipes()
+    recipes.add(recipe_id)
+    try:
+        yield
+    finally:
+        recipes.discard(recipe_id)
+
+
+def recipe_amounts(recipe_id):
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', 'amount'))
+
+
+@transaction.atomic
+def change_user_list(user_id, deltas):
+    """Прибавляет к списку покупок пользователя изменения количеств.
+
+    deltas — словарь {ingredient_id: изменение}, строки с нулевым итогом
+    удаляются.
+    """
+
+    items = {
+        item.ingredient_id: item
+        for item in ShoppingListItem.objects.select_for_update().filter(
+            user_id=user_id, ingredient_id__in=deltas
+        )
+    }
+    created, changed, removed = [], [], []
+    for ingredient_id, delta in deltas.items():
+        item = items.get(ingredient_id)
+        if item is None:
+            if delta > 0:
+                created.append(ShoppingListItem(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=delta
+                ))
+            continue
+        item.amount += delta
+        if item.amount > 0:
+            changed.append(item)
+        else:
+            removed.append(item.pk)
+    ShoppingListItem.objects.bulk_create(created)
+    if changed:
+        ShoppingListItem.objects.bulk_update(changed, ('amount',))
+    if removed:
+        ShoppingListItem.objects.filter(pk__in=removed).delete()
+
+
+def add_recipe(user_id, recipe_id):
+    change_user_list(user_id, recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    change_user_list(user_id, {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipe_amounts(recipe_id).items()
+    })
+
+
+def delta_case(deltas):
+    return Case(
+        *(
+            When(ingredient_id=ingredient_id, then=Value(delta))
+            for ingredient_id, delta in deltas.items()
+        ),
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+
+def insert_missing(recipe_id, deltas):
+    """Строки для ингредиентов, которых ещё нет в списках покупателей.
+
+    Один INSERT ... SELECT по корзинам рецепта; количества передаются
+    подзапросом из UNION ALL.
+    """
+
+    quote = connection.ops.quote_name
+    sql = INSERT_MISSING_SQL.format(
+        item=quote(ShoppingListItem._meta.db_table),
+        cart=quote(ShoppingCart._meta.db_table),
+        deltas=' UNION ALL '.join(
+            ['SELECT %s AS ingredient_id, %s AS amount'] * len(deltas)
+        ),
+    )
+    params = [value for item in deltas.items() for value in item]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, recipe_id])
+
+
+@transaction.atomic
+def apply_recipe_changes(recipe_id, deltas):
+    """Изменения ингредиентов рецепта для всех, у кого он в корзине.
+
+    Три запроса при любом числе ингредиентов и пользователей: UPDATE
+    с CASE по ингредиентам, INSERT недостающих строк и DELETE обнулённых.
+    """
+
+    users = ShoppingCart.objects.filter(recipe_id=recipe_id).values('user_id')
+    ShoppingListItem.objects.filter(
+        user_id__in=users, ingredient_id__in=deltas
+    ).update(amount=Greatest(F('amount') + delta_case(deltas), 0))
+    added = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta > 0
+    }
+    if added:
+        insert_missing(recipe_id, added)
+    ShoppingListItem.objects.filter(
+        user_id__in=users, ingredient_id__in=deltas, amount=0
+    ).delete()
+
+
+def apply_row_changes(removed=(), added=()):
+    """Изменения строк ингредиентов, сделанные в обход сериализатора.
+
+    removed и added — строки (recipe_id, ingredient_id, amount). Рецепты
+    из suspended_recipes() пропускаются: их изменения применяются
+    целиком в другом месте.
+    """
+
+    changes = defaultdict(Counter)
+    for recipe_id, ingredient_id, amount in removed:
+        changes[recipe_id][ingredient_id] -= amount
+    for recipe_id, ingredient_id, amount in added:
+        changes[recipe_id][ingredient_id] += amount
+    skipped = suspended_recipes()
+    for recipe_id, deltas in changes.items():
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if deltas and recipe_id not in skipped:
+            apply_recipe_changes(recipe_id, deltas)
+
+
+def expected_items(user_ids):
+    """Списки покупок пользователей, посчитанные по корзинам заново."""
+
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe__shopping_recipe__user_id__in=user_ids
+        ).values_list(
+            'recipe__shopping_recipe__user_id', 'ingredient_id'
+        ).annotate(total=Sum('amount')).order_by()
+    }
+
+
+@transaction.atomic
+def rebuild(user_ids):
+    """Пересобирает списки покупок пользователей с нуля."""
+
+    ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount
+        )
+        for (user_id, ingredient_id), amount in expected_items(
+            user_ids
+        ).items()
+    ])
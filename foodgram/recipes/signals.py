@@ -0,0 +1,154 @@
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from recipes import counters, images, search, shopping_list
+from recipes.models import (
+    FavoriteRecipe, Ingredient, Recipe, RecipeIngredient, ShoppingCart
+)
+from users.models import User
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(
+            User.objects.filter(pk=instance.author_id), 'recipes_count'
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    counters.recount(
+        User.objects.filter(pk=instance.author_id), 'recipes_count',
+        Recipe, 'author'
+    )
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def favorite_created(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(
+            Recipe.objects.filter(pk=instance.recipe_id), 'favorites_count'
+        )
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def favorite_deleted(sender, instance, **kwargs):
+    counters.recount(
+        Recipe.objects.filter(pk=instance.recipe_id), 'favorites_count',
+        FavoriteRecipe, 'recipe'
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_created(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            'shopping_cart_count'
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_deleted(sender, instance, **kwargs):
+    counters.recount(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        'shopping_cart_count',
+        ShoppingCart,
+        'recipe'
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_list_recipe_added(sender, instance, created, **kwargs):
+    if created:
+        shopping_list.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_list_recipe_removed(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты
+    # ещё не удалены.
+    shopping_list.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def shopping_list_recipe_deleting(sender, instance, **kwargs):
+    # Корзины рецепта вычитают его целиком в pre_delete, каскадное
+    # удаление строк ингредиентов не должно вычесть их второй раз.
+    shopping_list.suspended_recipes().add(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def shopping_list_recipe_deleted(sender, instance, **kwargs):
+    shopping_list.suspended_recipes().discard(instance.pk)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, **kwargs):
+    instance.previous_row = None if instance._state.adding else (
+        RecipeIngredient.objects.filter(pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        ).first()
+    )
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def shopping_list_ingredient_saved(sender, instance, **kwargs):
+    previous = getattr(instance, 'previous_row', None)
+    shopping_list.apply_row_changes(
+        removed=(previous,) if previous else (),
+        added=((instance.recipe_id, instance.ingredient_id, instance.amount),)
+    )
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def shopping_list_ingredient_deleted(sender, instance, **kwargs):
+    shopping_list.apply_row_changes(removed=(
+        (instance.recipe_id, instance.ingredient_id, instance.amount),
+    ))
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_image(sender, instance, **kwargs):
+    instance.previous_image = None if instance._state.adding else (
+        Recipe.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    name = instance.image.name
+    if name and instance.variants_image != name:
+        images.schedule(instance.pk, name)
+    previous = getattr(instance, 'previous_image', None)
+    if previous != name:
+        images.track((name,))
+        images.release((previous,))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_released(sender, instance, **kwargs):
+    images.release((instance.image.name,))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_search_changed(sender, instance, **kwargs):
+    search.schedule_update((instance.pk,))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_search_changed(sender, instance, **kwargs):
+    search.schedule_update((instance.recipe_id,))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_search_changed(sender, instance, created, **kwargs):
+    if not created:
+        search.schedule_update(Recipe.objects.filter(
+            ingredients=instance
+        ).values_list('pk', flat=True))
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_recipes_count(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User.objects.update(
+        recipes_count=Coalesce(
+            Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('pk')
+                ).order_by().values('author').annotate(
+                    total=Count('pk')
+                ).values('total')
+            ),
+            0
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_auto_20261018_0256'),
+        ('users', '0004_auto_20240125_2211'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_recipes_count, migrations.RunPython.noop),
+    ]
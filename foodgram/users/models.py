@@ -2,7 +2,28 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    """Сохранение модели без перезаписи счётчиков.
+
+    Счётчики меняются атомарно через F-выражения, поэтому полное
+    сохранение объекта со старыми значениями не должно их затирать.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding
+                and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CounterFieldsMixin, AbstractUser):
     """Класс пользователя."""
 
     email = models.EmailField(
@@ -23,6 +44,13 @@ class User(AbstractUser):
         max_length=150,
         verbose_name='Фамилия'
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('recipes_count',)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']